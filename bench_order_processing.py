@@ -0,0 +1,366 @@
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+import timeit
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+from exam import (
+    AdaptiveAPIClient,
+    APIException,
+    HedgingAPIClient,
+    InMemoryDatabaseService,
+    Order,
+    OrderDatasetGenerator,
+    OrderExporter,
+    OrderProcessingService,
+    PrefetchingDriver,
+    ScriptedLatencyAPIClient,
+    SyntheticAPIClient,
+    WorkStealingScheduler,
+    _percentile,
+    write_orders_csv
+)
+
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LAZY_MODULES = (
+    'argparse',
+    'asyncio',
+    'concurrent.futures',
+    'cProfile',
+    'csv',
+    'json',
+    'mmap',
+    'pstats',
+    'queue',
+    'random',
+    'tempfile',
+    'tracemalloc'
+)
+
+
+def _run_python(code: str, *options: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *options, '-c', code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=PACKAGE_DIR
+    )
+
+
+def eagerly_loaded_modules() -> list:
+    code = (
+        'import sys, exam\n'
+        'exam.OrderProcessingService(exam.InMemoryDatabaseService(), exam.SyntheticAPIClient())\n'
+        f'print(",".join(m for m in {LAZY_MODULES!r} if m in sys.modules))'
+    )
+    return [module for module in _run_python(code).stdout.strip().split(',') if module]
+
+
+def bench_startup(repeat: int = 5) -> None:
+    import_times = []
+    for _ in range(repeat):
+        stderr = _run_python('import exam', '-X', 'importtime').stderr
+        exam_line = [line for line in stderr.splitlines() if line.rstrip().endswith('| exam')][-1]
+        import_times.append(int(exam_line.split('|')[1]) / 1e6)
+
+    number = 10000
+    construction_times = timeit.repeat(
+        lambda: OrderProcessingService(InMemoryDatabaseService(), SyntheticAPIClient()),
+        number=number,
+        repeat=repeat
+    )
+
+    print('startup')
+    print(f'  import exam (best of {repeat}): {min(import_times) * 1e3:.2f} ms')
+    print(f'  OrderProcessingService(): {min(construction_times) / number * 1e6:.2f} us')
+    print(f'  optional modules loaded eagerly: {", ".join(eagerly_loaded_modules()) or "none"}')
+
+
+class SlowDatabaseService(InMemoryDatabaseService):
+    def __init__(self, orders_by_user: dict, update_latency: float, fetch_latency: float = 0.0):
+        super().__init__(orders_by_user)
+        self.update_latency = update_latency
+        self.fetch_latency = fetch_latency
+
+    def get_orders_by_user(self, user_id: int) -> list:
+        if self.fetch_latency:
+            time.sleep(self.fetch_latency)
+        return super().get_orders_by_user(user_id)
+
+    def update_order_status(self, order_id: int, status: str, priority: str) -> bool:
+        time.sleep(self.update_latency)
+        return super().update_order_status(order_id, status, priority)
+
+
+def skewed_users(whales: int, whale_orders: int, small_users: int, small_orders: int = 5) -> dict:
+    orders_by_user = {}
+    order_id = 0
+    for user_id in range(1, whales + small_users + 1):
+        count = whale_orders if user_id <= whales else small_orders
+        orders_by_user[user_id] = [
+            Order(order_id + offset, 'C', 100.0, offset % 2 == 0) for offset in range(1, count + 1)
+        ]
+        order_id += count
+    return orders_by_user
+
+
+SCHEDULING_MIXES = (
+    {'whales': 2, 'whale_orders': 2000, 'small_users': 200},
+    {'whales': 8, 'whale_orders': 1000, 'small_users': 2000}
+)
+
+
+def bench_scheduling(workers: int = 8, update_latency: float = 0.0002) -> None:
+    for mix in SCHEDULING_MIXES:
+        user_ids = list(skewed_users(**mix))
+
+        service = OrderProcessingService(SlowDatabaseService(skewed_users(**mix), update_latency), SyntheticAPIClient())
+        completion_times = {}
+        lock = threading.Lock()
+        started = time.monotonic()
+
+        def process(user_id: int) -> None:
+            service.process_orders(user_id)
+            with lock:
+                completion_times[user_id] = time.monotonic() - started
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(process, user_ids))
+        pool_makespan = time.monotonic() - started
+        pool_p99 = _percentile(list(completion_times.values()), 0.99)
+
+        service = OrderProcessingService(SlowDatabaseService(skewed_users(**mix), update_latency), SyntheticAPIClient())
+        scheduler = WorkStealingScheduler(service, workers=workers, chunk_size=64)
+        scheduler.run(user_ids)
+
+        print(
+            f'scheduling ({mix["whales"]} users x {mix["whale_orders"]} orders, '
+            f'{mix["small_users"]} users x 5 orders, {workers} workers)'
+        )
+        print(f'  thread pool per user:  makespan {pool_makespan * 1e3:.1f} ms, p99 user completion {pool_p99 * 1e3:.1f} ms')
+        print(
+            f'  work-stealing chunks:  makespan {scheduler.makespan * 1e3:.1f} ms, '
+            f'p99 user completion {scheduler.completion_percentile(0.99) * 1e3:.1f} ms, {scheduler.steal_count} steals'
+        )
+
+
+def overloaded_latency(base: float, capacity: Callable[[float], int]) -> Callable[[float, int], float]:
+    # Latency stays at base up to the API's capacity and grows linearly with
+    # the queue beyond it.
+    return lambda elapsed, in_flight: base * max(1.0, in_flight / capacity(elapsed))
+
+
+def _drive(api_client, callers: int, duration: float) -> tuple:
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def call() -> None:
+        order_id = 0
+        while time.monotonic() < stop_at:
+            order_id += 1
+            started = time.monotonic()
+            try:
+                api_client.call_api(order_id)
+            except APIException:
+                with lock:
+                    failures.append(order_id)
+                continue
+            with lock:
+                latencies.append(time.monotonic() - started)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(failures)
+
+
+def _print_goodput(label: str, latencies: list, failures: int, duration: float) -> None:
+    print(
+        f'  {label}: {len(latencies) / duration:.0f} successful calls/s, '
+        f'{failures / max(len(latencies) + failures, 1):.1%} failed, '
+        f'p99 caller latency {_percentile(latencies, 0.99) * 1e3:.1f} ms'
+    )
+
+
+def bench_adaptive(callers: int = 32, phase: float = 0.5, base_latency: float = 0.002) -> None:
+    # The API serves 16 concurrent calls at base latency for the first phase
+    # and 4 afterwards; calls queued past 4x the base latency fail.
+    capacity = lambda elapsed: 16 if elapsed < phase else 4
+    print(f'adaptive ({callers} callers, API capacity 16 then 4 after {phase:.1f} s)')
+
+    api = ScriptedLatencyAPIClient(overloaded_latency(base_latency, capacity), error_above=base_latency * 4)
+    _print_goodput(f'fixed concurrency {callers}', *_drive(api, callers, phase * 2), phase * 2)
+
+    api = ScriptedLatencyAPIClient(overloaded_latency(base_latency, capacity), error_above=base_latency * 4)
+    client = AdaptiveAPIClient(api, latency_target=base_latency * 2, initial_limit=4)
+    limits = []
+    sampler_stop = threading.Event()
+
+    def sample() -> None:
+        while not sampler_stop.wait(0.01):
+            limits.append(client.current_limit)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    _print_goodput('adaptive limit', *_drive(client, callers, phase * 2), phase * 2)
+    sampler_stop.set()
+    sampler.join()
+    half = len(limits) // 2
+    print(
+        f'  current_limit: mean {sum(limits[:half]) / max(half, 1):.1f} in phase 1, '
+        f'{sum(limits[half:]) / max(len(limits) - half, 1):.1f} in phase 2, '
+        f'{client.metrics()["limit_decreases"]} cuts'
+    )
+
+
+def heavy_tail_latency(fast: float, slow: float, slow_ratio: float, seed: int = 7) -> Callable[[float, int], float]:
+    import random
+
+    rng = random.Random(seed)
+    return lambda elapsed, in_flight: slow if rng.random() < slow_ratio else fast
+
+
+def _timed_calls(api_client, callers: int, calls_per_caller: int) -> list:
+    latencies = []
+    lock = threading.Lock()
+
+    def call(caller: int) -> None:
+        for index in range(calls_per_caller):
+            started = time.monotonic()
+            api_client.call_api(caller * calls_per_caller + index)
+            with lock:
+                latencies.append(time.monotonic() - started)
+
+    threads = [threading.Thread(target=call, args=(caller,)) for caller in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def bench_hedging(callers: int = 8, calls_per_caller: int = 300, max_hedge_ratio: float = 0.05) -> None:
+    # 3% of calls take 50 ms instead of 2 ms.
+    print(f'hedging ({callers * calls_per_caller} calls from {callers} callers, 3% of calls 25x slower)')
+    baseline = _timed_calls(ScriptedLatencyAPIClient(heavy_tail_latency(0.002, 0.05, 0.03)), callers, calls_per_caller)
+    print(
+        f'  unhedged:  p50 {_percentile(baseline, 0.5) * 1e3:.1f} ms, '
+        f'p99 {_percentile(baseline, 0.99) * 1e3:.1f} ms'
+    )
+
+    api = ScriptedLatencyAPIClient(heavy_tail_latency(0.002, 0.05, 0.03))
+    client = HedgingAPIClient(api, hedge_percentile=0.95, max_hedge_ratio=max_hedge_ratio)
+    hedged = _timed_calls(client, callers, calls_per_caller)
+    client.close()
+    metrics = client.metrics()
+    print(
+        f'  hedged:    p50 {_percentile(hedged, 0.5) * 1e3:.1f} ms, '
+        f'p99 {_percentile(hedged, 0.99) * 1e3:.1f} ms, '
+        f'hedge rate {metrics["hedge_rate"]:.1%} (cap {max_hedge_ratio:.0%}), '
+        f'{metrics["hedge_wins"]} hedges answered first'
+    )
+    print(f'  p99 improvement: {_percentile(baseline, 0.99) / _percentile(hedged, 0.99):.1f}x')
+
+
+def bench_prefetch(users: int = 100, fetch_latency: float = 0.004, update_latency: float = 0.001) -> None:
+    user_ids = list(skewed_users(0, 0, users, 4))
+    print(f'prefetch ({users} users x 4 orders, {fetch_latency * 1e3:.0f} ms fetch, {update_latency * 1e3:.0f} ms per update)')
+
+    service = OrderProcessingService(
+        SlowDatabaseService(skewed_users(0, 0, users, 4), update_latency, fetch_latency),
+        SyntheticAPIClient()
+    )
+    started = time.monotonic()
+    for user_id in user_ids:
+        service.process_orders(user_id)
+    print(f'  process_orders loop: {(time.monotonic() - started) * 1e3:.0f} ms')
+
+    for lookahead in (1, 4):
+        service = OrderProcessingService(
+            SlowDatabaseService(skewed_users(0, 0, users, 4), update_latency, fetch_latency),
+            SyntheticAPIClient()
+        )
+        driver = PrefetchingDriver(service, lookahead=lookahead)
+        started = time.monotonic()
+        driver.run(user_ids)
+        print(
+            f'  prefetch lookahead {lookahead}: {(time.monotonic() - started) * 1e3:.0f} ms, '
+            f'{driver.fetch_wait * 1e3:.0f} ms waiting for fetches'
+        )
+
+
+def _csv_writer_rows(file_handle, orders: list) -> None:
+    import csv
+
+    writer = csv.writer(file_handle)
+    writer.writerow(['ID', 'Type', 'Amount', 'Flag', 'Status', 'Priority'])
+    for order in orders:
+        writer.writerow([order.id, order.type, order.amount, str(order.flag).lower(), order.status, order.priority])
+        if order.amount > 150:
+            writer.writerow(['', '', '', '', 'Note', 'High value order'])
+
+
+def bench_csv(rows: int = 1_000_000, exports: int = 5000) -> None:
+    import io
+    import tempfile
+
+    orders = [order for _, order in OrderDatasetGenerator(seed=11).iter_orders(rows)]
+    for order in orders:
+        order.status = 'exported'
+        order.priority = 'high' if order.amount > 200 else 'low'
+    print(f'csv ({rows} rows in memory, {exports} single-order export files)')
+
+    buffers = {}
+    for label, encode in (('csv.writer', _csv_writer_rows), ('write_orders_csv', write_orders_csv)):
+        buffers[label] = io.StringIO()
+        started = time.perf_counter()
+        encode(buffers[label], orders)
+        elapsed = time.perf_counter() - started
+        print(f'  {label:<17} {elapsed:.2f} s ({elapsed / rows * 1e9:.0f} ns/row)')
+    print(f'  identical output: {buffers["csv.writer"].getvalue() == buffers["write_orders_csv"].getvalue()}')
+
+    for fast_csv in (False, True):
+        with tempfile.TemporaryDirectory() as output_dir:
+            exporter = OrderExporter(output_dir, fast_csv=fast_csv)
+            started = time.perf_counter()
+            for user_id, order in enumerate(orders[:exports]):
+                exporter.export_order_to_csv(order, user_id)
+            elapsed = time.perf_counter() - started
+        print(f'  export_order_to_csv fast_csv={fast_csv}: {elapsed / exports * 1e6:.1f} us/export')
+
+
+BENCHMARKS = {
+    'startup': bench_startup,
+    'scheduling': bench_scheduling,
+    'adaptive': bench_adaptive,
+    'hedging': bench_hedging,
+    'prefetch': bench_prefetch,
+    'csv': bench_csv
+}
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Order processing benchmarks')
+    parser.add_argument('benchmarks', nargs='*', help=f'benchmarks to run: {", ".join(BENCHMARKS)} (default: all)')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(unknown)}')
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name]()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,42 @@
-import csv
+import bisect
+import copy
+import heapq
+import itertools
+import math
+import os
+import struct
+import sys
+import threading
 import time
+import zlib
 
 from abc import ABC, abstractmethod
-from typing import List, Any
+from collections import Counter, deque
+from collections.abc import Mapping, Sequence
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Any, Optional, Tuple, Union
+
+# Optional subsystems (CSV export, asyncio, profiling, file formats, ...) import
+# their modules on first use so short-lived workers only pay for what they run.
+if TYPE_CHECKING:
+	import mmap
+	import pstats
+	import queue
+	import random
+	from concurrent.futures import Future
+
+
+_lazy_modules: Dict[str, Any] = {}
+
+
+def _lazy_import(name: str) -> Any:
+	# Hot paths fetch optional modules through this cache so they pay the
+	# import once rather than an import-statement lookup on every call.
+	module = _lazy_modules.get(name)
+	if module is None:
+		import importlib
+
+		module = _lazy_modules[name] = importlib.import_module(name)
+	return module
 
 
 class Order:
@@ -29,6 +63,14 @@ class DatabaseException(Exception):
 	pass
 
 
+class APITimeoutException(APIException):
+	pass
+
+
+class DatabaseTimeoutException(DatabaseException):
+	pass
+
+
 class DatabaseService(ABC):
 	@abstractmethod
 	def get_orders_by_user(self, user_id: int) -> List[Order]:
@@ -38,18 +80,801 @@ class DatabaseService(ABC):
 	def update_order_status(self, order_id: int, status: str, priority: str) -> bool:
 		pass
 
+	def get_orders_by_users(self, user_ids: Iterable[int]) -> Dict[int, List[Order]]:
+		# Backends that can fetch many users in one query should override this.
+		return {user_id: self.get_orders_by_user(user_id) for user_id in user_ids}
+
+	def update_order_statuses(self, updates: List[Tuple[int, str, str]]) -> List[Any]:
+		# Failed updates are returned in place as their exception so one bad
+		# row does not fail the rest of the batch.
+		results = []
+		for order_id, status, priority in updates:
+			try:
+				results.append(self.update_order_status(order_id, status, priority))
+			except Exception as exc:
+				results.append(exc)
+		return results
+
 
 class APIClient(ABC):
 	@abstractmethod
 	def call_api(self, order_id: int) -> APIResponse:
 		pass
 
+	def call_api_batch(self, order_ids: List[int]) -> List[Any]:
+		results = []
+		for order_id in order_ids:
+			try:
+				results.append(self.call_api(order_id))
+			except Exception as exc:
+				results.append(exc)
+		return results
+
+
+class Histogram:
+	def __init__(self, bounds: List[float]):
+		self.bounds = sorted(bounds)
+		self.bucket_counts = [0] * (len(self.bounds) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+		self._lock = threading.Lock()
+
+	def observe(self, value: float) -> None:
+		with self._lock:
+			self.bucket_counts[bisect.bisect_left(self.bounds, value)] += 1
+			self.count += 1
+			self.total += value
+			self.max = max(self.max, value)
+
+	def snapshot(self) -> Dict[str, Any]:
+		with self._lock:
+			labels = [f'<={bound}' for bound in self.bounds] + ['+inf']
+			return {
+				'buckets': dict(zip(labels, self.bucket_counts)),
+				'count': self.count,
+				'sum': self.total,
+				'mean': self.total / self.count if self.count else 0.0,
+				'max': self.max
+			}
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+	# Nearest-rank percentile; 0.0 for an empty sample.
+	if not values:
+		return 0.0
+	ordered = sorted(values)
+	rank = min(max(math.ceil(fraction * len(ordered)), 1), len(ordered))
+	return ordered[rank - 1]
+
+
+BATCH_SIZE_BOUNDS = [1, 2, 5, 10, 20, 50, 100, 200, 500]
+
+WAIT_TIME_BOUNDS = [0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1]
+
+
+class MicroBatcher:
+	def __init__(
+		self,
+		flush: Callable[[List[Any]], List[Any]],
+		max_batch_size: int = 50,
+		max_wait: float = 0.005
+	):
+		if max_batch_size < 1:
+			raise ValueError('max_batch_size must be at least 1')
+		self._flush = flush
+		self.max_batch_size = max_batch_size
+		self.max_wait = max_wait
+		self.batch_sizes = Histogram(BATCH_SIZE_BOUNDS)
+		self.wait_times = Histogram(WAIT_TIME_BOUNDS)
+		self._pending: List[Tuple[Any, 'Future', float]] = []
+		self._condition = threading.Condition()
+		self._last_batch_size = 0
+		self._closed = False
+		self._worker: Optional[threading.Thread] = None
+
+	def submit(self, item: Any) -> 'Future':
+		future = _lazy_import('concurrent.futures').Future()
+		with self._condition:
+			if self._closed:
+				raise RuntimeError('batcher is closed')
+			self._pending.append((item, future, time.monotonic()))
+			if self._worker is None:
+				self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+				self._worker.start()
+			self._condition.notify()
+		return future
+
+	def _next_batch(self) -> List[Tuple[Any, 'Future', float]]:
+		with self._condition:
+			while not self._pending and not self._closed:
+				self._condition.wait()
+
+			# Only hold the window open once traffic has shown it can fill a
+			# batch; a lone request under light load is flushed straight away.
+			if self._last_batch_size > 1 and self._pending:
+				deadline = self._pending[0][2] + self.max_wait
+				while len(self._pending) < self.max_batch_size and not self._closed:
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						break
+					self._condition.wait(remaining)
+
+			batch = self._pending[:self.max_batch_size]
+			del self._pending[:self.max_batch_size]
+			self._last_batch_size = len(batch)
+			return batch
+
+	def _run(self) -> None:
+		while True:
+			batch = self._next_batch()
+			if not batch:
+				return
+			self._flush_batch(batch)
+
+	def _flush_batch(self, batch: List[Tuple[Any, 'Future', float]]) -> None:
+		now = time.monotonic()
+		self.batch_sizes.observe(len(batch))
+		for _, _, submitted in batch:
+			self.wait_times.observe(now - submitted)
+
+		try:
+			results = self._flush([item for item, _, _ in batch])
+			if results is None or len(results) != len(batch):
+				raise ValueError(
+					f'flush returned {0 if results is None else len(results)} results for a batch of {len(batch)}'
+				)
+		except Exception as exc:
+			# Every caller must hear back, otherwise submit().result() blocks forever.
+			for _, future, _ in batch:
+				future.set_exception(exc)
+			return
+
+		for (_, future, _), result in zip(batch, results):
+			if isinstance(result, Exception):
+				future.set_exception(result)
+			else:
+				future.set_result(result)
+
+	def metrics(self) -> Dict[str, Any]:
+		return {
+			'batch_size': self.batch_sizes.snapshot(),
+			'wait_time': self.wait_times.snapshot()
+		}
+
+	def close(self) -> None:
+		with self._condition:
+			self._closed = True
+			self._condition.notify_all()
+			worker = self._worker
+		if worker is not None:
+			worker.join()
+
+
+class BatchingDatabaseService(DatabaseService):
+	def __init__(self, db_service: DatabaseService, max_batch_size: int = 50, max_wait: float = 0.005):
+		self.db_service = db_service
+		self.batcher = MicroBatcher(db_service.update_order_statuses, max_batch_size, max_wait)
+
+	def get_orders_by_user(self, user_id: int) -> List[Order]:
+		return self.db_service.get_orders_by_user(user_id)
+
+	def get_orders_by_users(self, user_ids: Iterable[int]) -> Dict[int, List[Order]]:
+		return self.db_service.get_orders_by_users(user_ids)
+
+	def update_order_status(self, order_id: int, status: str, priority: str) -> bool:
+		return self.batcher.submit((order_id, status, priority)).result()
+
+	def update_order_statuses(self, updates: List[Tuple[int, str, str]]) -> List[Any]:
+		return self.db_service.update_order_statuses(updates)
+
+	def metrics(self) -> Dict[str, Any]:
+		return self.batcher.metrics()
+
+	def close(self) -> None:
+		self.batcher.close()
+
+
+class BatchingAPIClient(APIClient):
+	def __init__(self, api_client: APIClient, max_batch_size: int = 50, max_wait: float = 0.005):
+		self.api_client = api_client
+		self.batcher = MicroBatcher(api_client.call_api_batch, max_batch_size, max_wait)
+
+	def call_api(self, order_id: int) -> APIResponse:
+		return self.batcher.submit(order_id).result()
+
+	def call_api_batch(self, order_ids: List[int]) -> List[Any]:
+		return self.api_client.call_api_batch(order_ids)
+
+	def metrics(self) -> Dict[str, Any]:
+		return self.batcher.metrics()
+
+	def close(self) -> None:
+		self.batcher.close()
+
+
+class TokenBucket:
+	def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic):
+		if rate <= 0:
+			raise ValueError('rate must be positive')
+		if burst < 1:
+			raise ValueError('burst must be at least 1')
+		self.rate = rate
+		self.burst = burst
+		self._clock = clock
+		self._tokens = float(burst)
+		self._updated = clock()
+		self._lock = threading.Lock()
+
+	def reserve(self) -> float:
+		# Takes a token immediately and returns how long the caller has to wait
+		# before using it, so waiters are served in arrival order.
+		with self._lock:
+			now = self._clock()
+			self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+			self._updated = now
+			self._tokens -= 1
+			if self._tokens >= 0:
+				return 0.0
+			return -self._tokens / self.rate
+
+
+class RateLimitedAPIClient(APIClient):
+	def __init__(
+		self,
+		api_client: APIClient,
+		rate: float,
+		burst: int = 1,
+		clock: Callable[[], float] = time.monotonic,
+		sleep: Callable[[float], None] = time.sleep
+	):
+		self.api_client = api_client
+		self.bucket = TokenBucket(rate, burst, clock)
+		self._sleep = sleep
+		self._metrics_lock = threading.Lock()
+		self.calls = 0
+		self.throttled_calls = 0
+		self.total_wait = 0.0
+		self.max_wait = 0.0
+
+	def _acquire(self) -> float:
+		wait = self.bucket.reserve()
+		with self._metrics_lock:
+			self.calls += 1
+			if wait > 0:
+				self.throttled_calls += 1
+				self.total_wait += wait
+				self.max_wait = max(self.max_wait, wait)
+		return wait
+
+	def call_api(self, order_id: int) -> APIResponse:
+		wait = self._acquire()
+		if wait > 0:
+			self._sleep(wait)
+		return self.api_client.call_api(order_id)
+
+	async def call_api_async(self, order_id: int) -> APIResponse:
+		asyncio = _lazy_import('asyncio')
+		wait = self._acquire()
+		if wait > 0:
+			await asyncio.sleep(wait)
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(None, self.api_client.call_api, order_id)
+
+	def metrics(self) -> Dict[str, float]:
+		with self._metrics_lock:
+			return {
+				'calls': self.calls,
+				'throttled_calls': self.throttled_calls,
+				'total_wait': self.total_wait,
+				'max_wait': self.max_wait,
+				'mean_wait': self.total_wait / self.calls if self.calls else 0.0
+			}
+
+
+class AdaptiveAPIClient(APIClient):
+	# AIMD limit on concurrent call_api calls. A healthy call made while at
+	# least half the limit was in use adds 1/limit, so the limit grows by
+	# about one per round of calls; a call that raises APIException or takes
+	# longer than latency_target multiplies it by backoff. Only calls started
+	# after the previous cut can cut again, so a burst of slow calls from one
+	# round counts as a single signal.
+	def __init__(
+		self,
+		api_client: APIClient,
+		latency_target: float,
+		initial_limit: int = 4,
+		min_limit: int = 1,
+		max_limit: int = 64,
+		backoff: float = 0.5,
+		clock: Callable[[], float] = time.monotonic
+	):
+		if not 1 <= min_limit <= initial_limit <= max_limit:
+			raise ValueError('limits must satisfy 1 <= min_limit <= initial_limit <= max_limit')
+		if not 0 < backoff < 1:
+			raise ValueError('backoff must be between 0 and 1')
+		self.api_client = api_client
+		self.latency_target = latency_target
+		self.min_limit = min_limit
+		self.max_limit = max_limit
+		self.backoff = backoff
+		self._clock = clock
+		self._limit = float(initial_limit)
+		self._last_decrease = float('-inf')
+		self._condition = threading.Condition()
+		self.in_flight = 0
+		self.max_in_flight = 0
+		self.calls = 0
+		self.failed_calls = 0
+		self.slow_calls = 0
+		self.limit_decreases = 0
+
+	@property
+	def current_limit(self) -> int:
+		return int(self._limit)
+
+	def _acquire(self) -> Tuple[float, bool]:
+		with self._condition:
+			while self.in_flight >= int(self._limit):
+				self._condition.wait()
+			self.in_flight += 1
+			self.calls += 1
+			self.max_in_flight = max(self.max_in_flight, self.in_flight)
+			return self._clock(), self.in_flight * 2 >= self._limit
+
+	def _release(self, started: float, saturated: bool, failed: Optional[bool]) -> None:
+		latency = self._clock() - started
+		with self._condition:
+			self.in_flight -= 1
+			if failed is not None:
+				slow = not failed and latency > self.latency_target
+				if failed:
+					self.failed_calls += 1
+				if slow:
+					self.slow_calls += 1
+				if not failed and not slow:
+					if saturated:
+						self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+				elif started >= self._last_decrease:
+					self._limit = max(float(self.min_limit), self._limit * self.backoff)
+					self._last_decrease = self._clock()
+					self.limit_decreases += 1
+			self._condition.notify(max(int(self._limit) - self.in_flight, 0))
+
+	def call_api(self, order_id: int) -> APIResponse:
+		started, saturated = self._acquire()
+		failed = None
+		try:
+			response = self.api_client.call_api(order_id)
+			failed = False
+			return response
+		except APIException:
+			failed = True
+			raise
+		finally:
+			self._release(started, saturated, failed)
+
+	def metrics(self) -> Dict[str, float]:
+		with self._condition:
+			return {
+				'current_limit': int(self._limit),
+				'in_flight': self.in_flight,
+				'max_in_flight': self.max_in_flight,
+				'calls': self.calls,
+				'failed_calls': self.failed_calls,
+				'slow_calls': self.slow_calls,
+				'limit_decreases': self.limit_decreases
+			}
+
+
+class _InFlightCall:
+	def __init__(self):
+		self.done = threading.Event()
+		self.response = None
+		self.exception = None
+
+
+class SingleFlightAPIClient(APIClient):
+	def __init__(self, api_client: APIClient):
+		self.api_client = api_client
+		self._lock = threading.Lock()
+		self._in_flight: Dict[int, _InFlightCall] = {}
+		self.calls = 0
+		self.coalesced_calls = 0
+
+	def call_api(self, order_id: int) -> APIResponse:
+		with self._lock:
+			self.calls += 1
+			call = self._in_flight.get(order_id)
+			is_leader = call is None
+			if is_leader:
+				call = _InFlightCall()
+				self._in_flight[order_id] = call
+			else:
+				self.coalesced_calls += 1
+
+		if is_leader:
+			try:
+				call.response = self.api_client.call_api(order_id)
+			except Exception as exc:
+				call.exception = exc
+			finally:
+				with self._lock:
+					del self._in_flight[order_id]
+				call.done.set()
+		else:
+			call.done.wait()
+
+		if call.exception is not None:
+			raise call.exception
+		return call.response
+
+	def metrics(self) -> Dict[str, int]:
+		with self._lock:
+			return {
+				'calls': self.calls,
+				'coalesced_calls': self.coalesced_calls,
+				'upstream_calls': self.calls - self.coalesced_calls,
+				'in_flight': len(self._in_flight)
+			}
+
+
+class TimeoutRunner:
+	# Runs calls on daemon worker threads so callers can stop waiting for them.
+	# Python cannot cancel a call that has started: a timed-out call keeps its
+	# worker until it returns. Replacement workers are started for such
+	# abandoned calls, up to max_abandoned; beyond that new calls fail fast
+	# instead of queueing behind hung ones. Workers are daemon threads, so hung
+	# calls never block interpreter exit.
+	def __init__(self, max_workers: int = 8, max_abandoned: int = 32):
+		import concurrent.futures
+		import queue
+
+		if max_workers < 1:
+			raise ValueError('max_workers must be at least 1')
+		self._futures = concurrent.futures
+		self._tasks = queue.SimpleQueue()
+		self.max_workers = max_workers
+		self.max_abandoned = max_abandoned
+		self._lock = threading.Lock()
+		self._workers = 0
+		self._idle = 0
+		self._abandoned = set()
+		self._closed = False
+
+	@property
+	def abandoned_calls(self) -> int:
+		with self._lock:
+			return len(self._abandoned)
+
+	def submit(self, function: Callable, *args: Any) -> 'Future':
+		future = self._futures.Future()
+		with self._lock:
+			self._enqueue(future, function, args)
+		return future
+
+	def _enqueue(self, future: 'Future', function: Callable, args: Tuple[Any, ...]) -> None:
+		if self._closed:
+			raise RuntimeError('timeout runner is closed')
+		if self._idle == 0 and self._workers < self.max_workers + len(self._abandoned):
+			self._workers += 1
+			threading.Thread(target=self._work, name='timeout-runner', daemon=True).start()
+		self._tasks.put((future, function, args))
+
+	def run(self, timeout: float, timeout_exception: type, function: Callable, *args: Any) -> Any:
+		future = self._futures.Future()
+		with self._lock:
+			if len(self._abandoned) >= self.max_abandoned:
+				raise timeout_exception(f'{len(self._abandoned)} timed-out calls are still running')
+			self._enqueue(future, function, args)
+
+		try:
+			return future.result(timeout=max(timeout, 0))
+		except self._futures.TimeoutError:
+			if future.done():
+				raise
+			if not future.cancel():
+				with self._lock:
+					if not future.done():
+						self._abandoned.add(future)
+			name = getattr(function, '__name__', repr(function))
+			raise timeout_exception(f'{name} timed out after {timeout:.3f}s')
+
+	def _work(self) -> None:
+		while True:
+			with self._lock:
+				self._idle += 1
+			task = self._tasks.get()
+			with self._lock:
+				self._idle -= 1
+			if task is None:
+				with self._lock:
+					self._workers -= 1
+				return
+
+			future, function, args = task
+			if not future.set_running_or_notify_cancel():
+				continue
+			try:
+				result = function(*args)
+			except BaseException as exc:
+				with self._lock:
+					future.set_exception(exc)
+					self._abandoned.discard(future)
+			else:
+				with self._lock:
+					future.set_result(result)
+					self._abandoned.discard(future)
+
+	def close(self) -> None:
+		# Idle workers exit; workers stuck in a hung call exit once it returns.
+		with self._lock:
+			if self._closed:
+				return
+			self._closed = True
+			workers = self._workers
+		for _ in range(workers):
+			self._tasks.put(None)
+
+
+def call_with_timeout(
+	runner: Optional[TimeoutRunner],
+	timeout: Optional[float],
+	timeout_exception: type,
+	function: Callable,
+	*args: Any
+) -> Any:
+	if timeout is None:
+		return function(*args)
+	return runner.run(timeout, timeout_exception, function, *args)
+
+
+class TimeoutAPIClient(APIClient):
+	def __init__(
+		self,
+		api_client: APIClient,
+		timeout: Optional[float],
+		budget: Callable[[], Optional[float]] = None,
+		runner: TimeoutRunner = None
+	):
+		self.api_client = api_client
+		self.timeout = timeout
+		self._budget = budget or (lambda: None)
+		self._runner = runner
+		self._owns_runner = runner is None
+		self._lock = threading.Lock()
+
+	def _get_runner(self) -> TimeoutRunner:
+		if self._runner is None:
+			with self._lock:
+				if self._runner is None:
+					self._runner = TimeoutRunner()
+		return self._runner
+
+	def call_api(self, order_id: int) -> APIResponse:
+		timeout = _tightest_timeout(self.timeout, self._budget())
+		if timeout is None:
+			return self.api_client.call_api(order_id)
+		return call_with_timeout(self._get_runner(), timeout, APITimeoutException, self.api_client.call_api, order_id)
+
+	def close(self) -> None:
+		if self._owns_runner and self._runner is not None:
+			self._runner.close()
+
+
+class HedgingAPIClient(APIClient):
+	# Runs call_api on runner workers and, when no answer has arrived within
+	# hedge_percentile of the recent latencies, sends one duplicate and returns
+	# whichever succeeds first. Hedges are capped at max_hedge_ratio of all
+	# calls and start once min_samples latencies have been observed. The
+	# losing call is not cancelled; it finishes on its worker.
+	def __init__(
+		self,
+		api_client: APIClient,
+		hedge_percentile: float = 0.95,
+		max_hedge_ratio: float = 0.05,
+		window: int = 1000,
+		min_samples: int = 50,
+		runner: TimeoutRunner = None,
+		clock: Callable[[], float] = time.monotonic
+	):
+		if not 0 < hedge_percentile <= 1:
+			raise ValueError('hedge_percentile must be in (0, 1]')
+		if not 0 <= max_hedge_ratio <= 1:
+			raise ValueError('max_hedge_ratio must be in [0, 1]')
+		self.api_client = api_client
+		self.hedge_percentile = hedge_percentile
+		self.max_hedge_ratio = max_hedge_ratio
+		self.min_samples = max(min_samples, 1)
+		self._runner = runner or TimeoutRunner(max_workers=64)
+		self._owns_runner = runner is None
+		self._clock = clock
+		self._lock = threading.Lock()
+		self._latencies = deque(maxlen=window)
+		self._refresh_every = max(window // 20, 1)
+		self._until_refresh = 0
+		self._hedge_delay: Optional[float] = None
+		self.calls = 0
+		self.hedged_calls = 0
+		self.hedge_wins = 0
+
+	@property
+	def hedge_delay(self) -> Optional[float]:
+		return self._hedge_delay
+
+	def _observe(self, started: float, future: 'Future') -> None:
+		latency = self._clock() - started
+		if future.cancelled() or future.exception() is not None:
+			return
+		with self._lock:
+			self._latencies.append(latency)
+			self._until_refresh -= 1
+			if self._until_refresh <= 0 and len(self._latencies) >= self.min_samples:
+				self._hedge_delay = _percentile(list(self._latencies), self.hedge_percentile)
+				self._until_refresh = self._refresh_every
+
+	def _reserve_hedge(self) -> bool:
+		with self._lock:
+			if self.hedged_calls + 1 > self.max_hedge_ratio * self.calls:
+				return False
+			self.hedged_calls += 1
+			return True
+
+	def call_api(self, order_id: int) -> APIResponse:
+		futures = _lazy_import('concurrent.futures')
+		with self._lock:
+			self.calls += 1
+		delay = self._hedge_delay
+		started = self._clock()
+		primary = self._runner.submit(self.api_client.call_api, order_id)
+		primary.add_done_callback(lambda future: self._observe(started, future))
+		if delay is None:
+			return primary.result()
+		done, _ = futures.wait([primary], timeout=delay)
+		if done or not self._reserve_hedge():
+			return primary.result()
+
+		hedge = self._runner.submit(self.api_client.call_api, order_id)
+		failure = None
+		for future in futures.as_completed([primary, hedge]):
+			try:
+				response = future.result()
+			except APIException as exc:
+				failure = failure or exc
+				continue
+			if future is hedge:
+				with self._lock:
+					self.hedge_wins += 1
+			return response
+		raise failure
+
+	def metrics(self) -> Dict[str, float]:
+		with self._lock:
+			return {
+				'calls': self.calls,
+				'hedged_calls': self.hedged_calls,
+				'hedge_wins': self.hedge_wins,
+				'hedge_rate': self.hedged_calls / self.calls if self.calls else 0.0,
+				'hedge_delay': self._hedge_delay
+			}
+
+	def close(self) -> None:
+		if self._owns_runner:
+			self._runner.close()
+
+
+def _tightest_timeout(*timeouts: Optional[float]) -> Optional[float]:
+	bounded = [timeout for timeout in timeouts if timeout is not None]
+	return min(bounded) if bounded else None
+
+
+# Shared by every exporter so concurrent exports for the same user within the
+# same second never pick the same file name; next() on a count is atomic.
+_EXPORT_SEQUENCE = itertools.count(1)
+
+
+CSV_EXPORT_HEADER = 'ID,Type,Amount,Flag,Status,Priority\r\n'
+
+CSV_EXPORT_NOTE_ROW = ',,,,Note,High value order\r\n'
+
+_CSV_EXPORT_ROW = '{},{},{},{},{},{}\r\n'.format
+
+_CSV_PLAIN_TYPES = (int, float)
+
+
+def _csv_field(value: Any) -> str:
+	# Same text csv.writer (excel dialect, QUOTE_MINIMAL) emits for one field
+	# of a multi-field row.
+	if value is None:
+		return ''
+	if type(value) in _CSV_PLAIN_TYPES:
+		return str(value)
+	text = value if isinstance(value, str) else str(value)
+	if '"' in text:
+		return '"' + text.replace('"', '""') + '"'
+	if ',' in text or '\n' in text or '\r' in text:
+		return '"' + text + '"'
+	return text
+
+
+def encode_order_csv_row(order: Order) -> str:
+	# Formats the whole row at once and only falls back to quoting field by
+	# field when the row holds a None or a character that needs quoting.
+	flag = order.flag
+	if flag is True or flag is False:
+		row = f'{order.id},{order.type},{order.amount},{"true" if flag else "false"},{order.status},{order.priority}'
+		if row.count(',') == 5 and '"' not in row and '\n' not in row and '\r' not in row and 'None' not in row:
+			return row + '\r\n'
+	return _encode_quoted_order_csv_row(order)
+
+
+def _encode_quoted_order_csv_row(order: Order) -> str:
+	flag = order.flag
+	if flag is True:
+		flag_text = 'true'
+	elif flag is False:
+		flag_text = 'false'
+	else:
+		flag_text = _csv_field(str(flag).lower())
+	return _CSV_EXPORT_ROW(
+		_csv_field(order.id),
+		_csv_field(order.type),
+		_csv_field(order.amount),
+		flag_text,
+		_csv_field(order.status),
+		_csv_field(order.priority)
+	)
+
+
+def write_orders_csv(file_handle: Any, orders: Iterable[Order], chunk_rows: int = 4096) -> int:
+	# Writes the export header once and then each order's rows exactly as
+	# export_order_to_csv does, collecting chunk_rows lines in one reused
+	# buffer per writelines call. Returns the number of order rows.
+	buffer = [CSV_EXPORT_HEADER]
+	append = buffer.append
+	rows = 0
+	for order in orders:
+		append(encode_order_csv_row(order))
+		if order.amount > 150:
+			append(CSV_EXPORT_NOTE_ROW)
+		rows += 1
+		if len(buffer) >= chunk_rows:
+			file_handle.writelines(buffer)
+			buffer.clear()
+	file_handle.writelines(buffer)
+	return rows
+
 
 class OrderExporter:
+	# fast_csv writes through encode_order_csv_row instead of csv.writer; the
+	# bytes on disk are the same. opener replaces the builtin open for export
+	# files, e.g. to count file and byte I/O.
+	def __init__(self, output_dir: str = '.', fast_csv: bool = False, opener: Callable[..., Any] = None):
+		self.output_dir = output_dir
+		self.fast_csv = fast_csv
+		self.opener = opener
+
+	def _open(self, csv_file: str) -> Any:
+		if self.opener is not None:
+			return self.opener(csv_file, 'w', newline='')
+		return open(csv_file, 'w', newline='')
+
+	def _file_name(self, order: Order, user_id: int) -> str:
+		return f'orders_type_A_{user_id}_{int(time.time())}_{next(_EXPORT_SEQUENCE)}.csv'
+
+	def _file_path(self, order: Order, user_id: int) -> str:
+		return os.path.join(self.output_dir, self._file_name(order, user_id))
+
+	def _exported(self, csv_file: str, order: Order, user_id: int, rows: int) -> None:
+		pass
+
 	def export_order_to_csv(self, order: Order, user_id: int) -> str:
-		csv_file = f'orders_type_A_{user_id}_{int(time.time())}.csv'
+		if self.fast_csv:
+			return self._export_fast(order, user_id)
+		csv = _lazy_import('csv')
 		try:
-			with open(csv_file, 'w', newline='') as file_handle:
+			csv_file = self._file_path(order, user_id)
+			with self._open(csv_file) as file_handle:
 				writer = csv.writer(file_handle)
 				writer.writerow(['ID', 'Type', 'Amount', 'Flag', 'Status', 'Priority'])
 				writer.writerow([
@@ -60,13 +885,129 @@ class OrderExporter:
 					order.status,
 					order.priority
 				])
+				rows = 1
 				if order.amount > 150:
 					writer.writerow(['', '', '', '', 'Note', 'High value order'])
+					rows += 1
+			self._exported(csv_file, order, user_id, rows)
+			return 'exported'
+		except IOError:
+			return 'export_failed'
+
+	def _export_fast(self, order: Order, user_id: int) -> str:
+		try:
+			csv_file = self._file_path(order, user_id)
+			with self._open(csv_file) as file_handle:
+				if order.amount > 150:
+					file_handle.write(CSV_EXPORT_HEADER + encode_order_csv_row(order) + CSV_EXPORT_NOTE_ROW)
+					rows = 2
+				else:
+					file_handle.write(CSV_EXPORT_HEADER + encode_order_csv_row(order))
+					rows = 1
+			self._exported(csv_file, order, user_id, rows)
 			return 'exported'
 		except IOError:
 			return 'export_failed'
 
 
+class ExportManifest:
+	# Append-only NDJSON index of export files: one
+	# {"path", "user_id", "order_ids", "rows"} object per file, with paths
+	# relative to the manifest's directory. Lookups read only the lines
+	# appended since the previous lookup.
+	def __init__(self, path: str):
+		self.path = path
+		self._lock = threading.Lock()
+		self._file = None
+		self._read_offset = 0
+		self._by_user: Dict[int, List[Dict[str, Any]]] = {}
+
+	def append(self, relative_path: str, user_id: int, order_ids: List[int], rows: int) -> None:
+		line = _lazy_import('json').dumps(
+			{'path': relative_path, 'user_id': user_id, 'order_ids': order_ids, 'rows': rows},
+			separators=(',', ':')
+		)
+		with self._lock:
+			if self._file is None:
+				self._file = open(self.path, 'a')
+			self._file.write(line + '\n')
+			self._file.flush()
+
+	def _refresh(self) -> None:
+		json = _lazy_import('json')
+		if not os.path.exists(self.path):
+			return
+		with open(self.path) as file_handle:
+			file_handle.seek(self._read_offset)
+			while True:
+				line = file_handle.readline()
+				if not line.endswith('\n'):
+					break
+				self._read_offset = file_handle.tell()
+				entry = json.loads(line)
+				self._by_user.setdefault(entry['user_id'], []).append(entry)
+
+	def entries_for_user(self, user_id: int) -> List[Dict[str, Any]]:
+		with self._lock:
+			self._refresh()
+			return list(self._by_user.get(user_id, []))
+
+	def close(self) -> None:
+		with self._lock:
+			if self._file is not None:
+				self._file.close()
+				self._file = None
+
+
+class ShardedOrderExporter(OrderExporter):
+	# Lays exports out as <output_dir>/<user shard>/<UTC date>/<file>.csv so no
+	# single directory grows without bound, and records every file in an
+	# ExportManifest at <output_dir>/manifest.ndjson.
+	def __init__(
+		self,
+		output_dir: str = '.',
+		shards: int = 256,
+		manifest_name: str = 'manifest.ndjson',
+		clock: Callable[[], float] = time.time,
+		fast_csv: bool = False,
+		opener: Callable[..., Any] = None
+	):
+		if shards < 1:
+			raise ValueError('shards must be at least 1')
+		super().__init__(output_dir, fast_csv, opener)
+		self.shards = shards
+		self._shard_width = len(f'{shards - 1:x}')
+		self._clock = clock
+		self.manifest = ExportManifest(os.path.join(output_dir, manifest_name))
+		self._created_dirs = set()
+		self._dirs_lock = threading.Lock()
+
+	def shard_for_user(self, user_id: int) -> str:
+		return f'{zlib.crc32(str(user_id).encode()) % self.shards:0{self._shard_width}x}'
+
+	def _file_path(self, order: Order, user_id: int) -> str:
+		date = time.strftime('%Y-%m-%d', time.gmtime(self._clock()))
+		directory = os.path.join(self.output_dir, self.shard_for_user(user_id), date)
+		if directory not in self._created_dirs:
+			os.makedirs(directory, exist_ok=True)
+			with self._dirs_lock:
+				self._created_dirs.add(directory)
+		return os.path.join(directory, self._file_name(order, user_id))
+
+	def _exported(self, csv_file: str, order: Order, user_id: int, rows: int) -> None:
+		relative_path = os.path.relpath(csv_file, self.output_dir).replace(os.sep, '/')
+		self.manifest.append(relative_path, user_id, [order.id], rows)
+
+	def find_exports(self, user_id: int) -> List[str]:
+		return [
+			os.path.join(self.output_dir, *entry['path'].split('/'))
+			for entry in self.manifest.entries_for_user(user_id)
+		]
+
+	def close(self) -> None:
+		self.manifest.close()
+
+
 class OrderTypeAHandler:
 	def __init__(self, exporter: OrderExporter):
 		self.exporter = exporter
@@ -82,15 +1023,18 @@ class OrderTypeBHandler:
 	def handle(self, order: Order) -> str:
 		try:
 			api_response = self.api_client.call_api(order.id)
-			if api_response.status == 'success':
-				if api_response.data >= 50 and order.amount < 100:
-					return 'processed'
-				elif api_response.data < 50 or order.flag:
-					return 'pending'
-				return 'error'
-			return 'api_error'
 		except APIException:
 			return 'api_failure'
+		return self.decide(order, api_response)
+
+	def decide(self, order: Order, api_response: APIResponse) -> str:
+		if api_response.status == 'success':
+			if api_response.data >= 50 and order.amount < 100:
+				return 'processed'
+			elif api_response.data < 50 or order.flag:
+				return 'pending'
+			return 'error'
+		return 'api_error'
 
 
 class OrderTypeCHandler:
@@ -103,22 +1047,176 @@ class OrderPriorityManager:
 		return 'high' if order.amount > 200 else 'low'
 
 
+PRIORITY_RANKS = {'high': 0, 'low': 1}
+
+SCHEDULING_MODES = ('fifo', 'priority')
+
+
+class ProcessingReport:
+	def __init__(self, user_id: int):
+		self.user_id = user_id
+		self.success = False
+		self.completion_times: Dict[str, List[float]] = {}
+		self.duplicate_count = 0
+		self.deadline_exceeded = False
+		self.unprocessed_order_ids: List[int] = []
+
+	@property
+	def processed_count(self) -> int:
+		return sum(len(times) for times in self.completion_times.values())
+
+	def record_completion(self, priority: str, elapsed: float) -> None:
+		self.completion_times.setdefault(priority, []).append(elapsed)
+
+	def completion_summary(self) -> Dict[str, Dict[str, float]]:
+		return {
+			priority: {
+				'count': len(times),
+				'mean': sum(times) / len(times),
+				'max': max(times)
+			}
+			for priority, times in self.completion_times.items()
+		}
+
+
+class DryRunSummary:
+	def __init__(self):
+		self.decisions: List[Tuple[int, str, str]] = []
+		self.status_counts: Counter = Counter()
+		self.priority_counts: Counter = Counter()
+
+	def record(self, order_id: int, status: str, priority: str) -> None:
+		self.decisions.append((order_id, status, priority))
+		self.status_counts[status] += 1
+		self.priority_counts[priority] += 1
+
+
 class OrderProcessingService:
+	# Safe to share between threads: process_orders keeps its per-run state
+	# local, last_report is tracked per thread and lazily built handlers are
+	# created under a lock. The wrapped services must be thread-safe as well.
 	def __init__(
 		self,
 		db_service: DatabaseService,
 		api_client: APIClient,
-		order_exporter: OrderExporter = None
+		order_exporter: OrderExporter = None,
+		scheduling: str = 'fifo',
+		clock: Callable[[], float] = time.monotonic,
+		api_timeout: float = None,
+		db_timeout: float = None,
+		deadline: float = None,
+		timeout_workers: int = 8,
+		max_abandoned_calls: int = 32
 	):
+		if scheduling not in SCHEDULING_MODES:
+			raise ValueError(f'unknown scheduling mode: {scheduling}')
 		self.db_service = db_service
 		self.api_client = api_client
-		self.order_exporter = order_exporter or OrderExporter()
-		self.type_a_handler = OrderTypeAHandler(self.order_exporter)
-		self.type_b_handler = OrderTypeBHandler(api_client)
-		self.type_c_handler = OrderTypeCHandler()
 		self.priority_manager = OrderPriorityManager()
+		self.scheduling = scheduling
+		self._clock = clock
+		self._local = threading.local()
+
+		# Timeouts are in seconds per call; deadline bounds a whole
+		# process_orders run and also caps every call made during it.
+		self.api_timeout = api_timeout
+		self.db_timeout = db_timeout
+		self.deadline = deadline
+		self.timeout_workers = timeout_workers
+		self.max_abandoned_calls = max_abandoned_calls
+		self._timeout_runner: Optional[TimeoutRunner] = None
+
+		# Handlers and the exporter are only built once an order needs them.
+		self._build_lock = threading.Lock()
+		self._order_exporter = order_exporter
+		self._type_a_handler: Optional[OrderTypeAHandler] = None
+		self._type_b_handler: Optional[OrderTypeBHandler] = None
+		self._type_c_handler: Optional[OrderTypeCHandler] = None
+
+	@property
+	def last_report(self) -> Optional[ProcessingReport]:
+		return getattr(self._local, 'report', None)
+
+	@last_report.setter
+	def last_report(self, report: ProcessingReport) -> None:
+		self._local.report = report
+
+	def _remaining_time(self) -> Optional[float]:
+		deadline_at = getattr(self._local, 'deadline_at', None)
+		if deadline_at is None:
+			return None
+		return deadline_at - self._clock()
+
+	def _get_timeout_runner(self) -> TimeoutRunner:
+		if self._timeout_runner is None:
+			with self._build_lock:
+				if self._timeout_runner is None:
+					self._timeout_runner = TimeoutRunner(self.timeout_workers, self.max_abandoned_calls)
+		return self._timeout_runner
+
+	def close(self) -> None:
+		if self._timeout_runner is not None:
+			self._timeout_runner.close()
+
+	@property
+	def order_exporter(self) -> OrderExporter:
+		if self._order_exporter is None:
+			with self._build_lock:
+				if self._order_exporter is None:
+					self._order_exporter = OrderExporter()
+		return self._order_exporter
+
+	@property
+	def type_a_handler(self) -> OrderTypeAHandler:
+		if self._type_a_handler is None:
+			exporter = self.order_exporter
+			with self._build_lock:
+				if self._type_a_handler is None:
+					self._type_a_handler = OrderTypeAHandler(exporter)
+		return self._type_a_handler
+
+	@property
+	def type_b_handler(self) -> OrderTypeBHandler:
+		if self._type_b_handler is None:
+			api_client = self.api_client
+			if self.api_timeout is not None or self.deadline is not None:
+				api_client = TimeoutAPIClient(
+					api_client,
+					self.api_timeout,
+					self._remaining_time,
+					self._get_timeout_runner()
+				)
+			with self._build_lock:
+				if self._type_b_handler is None:
+					self._type_b_handler = OrderTypeBHandler(api_client)
+		return self._type_b_handler
 
-	def _process_order(self, order: Order, user_id: int) -> None:
+	@property
+	def type_c_handler(self) -> OrderTypeCHandler:
+		if self._type_c_handler is None:
+			with self._build_lock:
+				if self._type_c_handler is None:
+					self._type_c_handler = OrderTypeCHandler()
+		return self._type_c_handler
+
+	def _schedule(self, orders: List[Order]) -> Iterator[Order]:
+		if self.scheduling == 'fifo':
+			yield from orders
+			return
+
+		# Priority only depends on the amount, so it can be computed up front;
+		# the index keeps equal priorities in their original order.
+		queue = [
+			(PRIORITY_RANKS.get(self.priority_manager.determine_priority(order), len(PRIORITY_RANKS)), index, order)
+			for index, order in enumerate(orders)
+		]
+		heapq.heapify(queue)
+		while queue:
+			yield heapq.heappop(queue)[2]
+
+	def _process_order(self, order: Order, user_id: int) -> bool:
+		# Returns False when the run's deadline passed before the status could
+		# be written; the order is then left as deadline_exceeded, unwritten.
 		if order.type == 'A':
 			order.status = self.type_a_handler.handle(order, user_id)
 		elif order.type == 'B':
@@ -130,19 +1228,1352 @@ class OrderProcessingService:
 
 		order.priority = self.priority_manager.determine_priority(order)
 
+		remaining = self._remaining_time()
+		if remaining is not None and remaining <= 0:
+			order.status = 'deadline_exceeded'
+			return False
 		try:
-			self.db_service.update_order_status(order.id, order.status, order.priority)
+			timeout = _tightest_timeout(self.db_timeout, remaining)
+			if timeout is None:
+				self.db_service.update_order_status(order.id, order.status, order.priority)
+			else:
+				call_with_timeout(
+					self._get_timeout_runner(),
+					timeout,
+					DatabaseTimeoutException,
+					self.db_service.update_order_status,
+					order.id,
+					order.status,
+					order.priority
+				)
 		except DatabaseException:
 			order.status = 'db_error'
+		return True
 
 	def process_orders(self, user_id: int) -> bool:
+		return self._process_fetched_orders(user_id, self.db_service.get_orders_by_user)
+
+	def process_users(self, user_ids: Iterable[int], group_size: int = 100) -> Dict[int, bool]:
+		# Fetches group_size users per get_orders_by_users call, then runs each
+		# user exactly like process_orders; last_report is the last user's.
+		if group_size < 1:
+			raise ValueError('group_size must be at least 1')
+		user_ids = list(user_ids)
+		results = {}
+		for start in range(0, len(user_ids), group_size):
+			group = user_ids[start:start + group_size]
+			try:
+				fetch = self.db_service.get_orders_by_users(group).get
+			except Exception:
+				# One bad user must not fail the whole group: fetch each user on
+				# its own so only the users whose fetch fails return False.
+				fetch = self.db_service.get_orders_by_user
+			for user_id in group:
+				results[user_id] = self._process_fetched_orders(user_id, fetch)
+		return results
+
+	def _process_fetched_orders(self, user_id: int, fetch: Callable[[int], Optional[List[Order]]]) -> bool:
+		report = ProcessingReport(user_id)
+		self.last_report = report
+		started = self._clock()
+		self._local.deadline_at = started + self.deadline if self.deadline is not None else None
 		try:
-			orders = self.db_service.get_orders_by_user(user_id)
+			orders = fetch(user_id)
 			if not orders:
 				return False
+			return self._process_user_orders(orders, user_id, report, started)
+		except Exception:
+			return False
+		finally:
+			self._local.deadline_at = None
 
-			for order in orders:
-				self._process_order(order, user_id)
-			return True
+	def _process_user_orders(self, orders: List[Order], user_id: int, report: ProcessingReport, started: float) -> bool:
+		# Upstream joins can return the same record several times; each
+		# distinct record is processed once and its outcome copied.
+		processed: Dict[Tuple[Any, ...], Order] = {}
+		scheduled = self._schedule(orders)
+		for order in scheduled:
+			if self._copy_processed_duplicate(order, processed, report):
+				continue
+			remaining = self._remaining_time()
+			if remaining is None or remaining > 0:
+				if self._process_order(order, user_id):
+					processed[(order.id, order.type, order.amount, order.flag)] = order
+					report.record_completion(order.priority, self._clock() - started)
+					continue
+
+			# Duplicates of orders already written still get their outcome;
+			# everything else is left unprocessed.
+			report.deadline_exceeded = True
+			for unprocessed in itertools.chain([order], scheduled):
+				if not self._copy_processed_duplicate(unprocessed, processed, report):
+					unprocessed.status = 'deadline_exceeded'
+					report.unprocessed_order_ids.append(unprocessed.id)
+			return False
+		report.success = True
+		return True
+
+	def _copy_processed_duplicate(
+		self,
+		order: Order,
+		processed: Dict[Tuple[Any, ...], Order],
+		report: ProcessingReport
+	) -> bool:
+		original = processed.get((order.id, order.type, order.amount, order.flag))
+		if original is None:
+			return False
+		order.status = original.status
+		order.priority = original.priority
+		report.duplicate_count += 1
+		return True
+
+	def dry_run(
+		self,
+		orders: Iterable[Order],
+		api_data: Union[Mapping, APIClient] = None
+	) -> DryRunSummary:
+		# Runs only the decision rules: nothing is exported, no API is called
+		# other than the supplied cache, and neither the orders nor the
+		# database are updated. Type A orders are assumed to export cleanly.
+		api_data = api_data if api_data is not None else {}
+		summary = DryRunSummary()
+		for order in orders:
+			if order.type == 'A':
+				status = 'exported'
+			elif order.type == 'B':
+				status = self._dry_run_type_b(order, api_data)
+			elif order.type == 'C':
+				status = self.type_c_handler.handle(order)
+			else:
+				status = 'unknown_type'
+			summary.record(order.id, status, self.priority_manager.determine_priority(order))
+		return summary
+
+	def _dry_run_type_b(self, order: Order, api_data: Union[Mapping, APIClient]) -> str:
+		try:
+			if isinstance(api_data, APIClient):
+				api_response = api_data.call_api(order.id)
+			elif order.id in api_data:
+				api_response = api_data[order.id]
+			else:
+				return 'api_data_missing'
+		except APIException:
+			return 'api_failure'
+		if isinstance(api_response, APIException):
+			return 'api_failure'
+		try:
+			return self.type_b_handler.decide(order, api_response)
+		except TypeError:
+			return 'invalid_api_data'
+
+
+class _UserRun:
+	def __init__(self, user_id: int, report: ProcessingReport, started: float, deadline_at: Optional[float]):
+		self.user_id = user_id
+		self.report = report
+		self.started = started
+		self.deadline_at = deadline_at
+		self.duplicates: List[Tuple[Order, Order]] = []
+		self.pending_chunks = 0
+		self.failed = False
+		self.lock = threading.Lock()
+
+
+class WorkStealingScheduler:
+	# Runs many users through one service on a fixed set of workers. Each
+	# user's orders are split into chunks of at most chunk_size; a worker
+	# starts the users queued on its own deque first while idle workers steal
+	# chunks from the other end, so a huge user is spread over every idle
+	# worker instead of pinning one while small users queue behind it. A user's result is
+	# published once, after its last chunk, with process_orders semantics:
+	# False when the fetch fails, there are no orders, an order raises or
+	# the deadline expires.
+	def __init__(
+		self,
+		service: OrderProcessingService,
+		workers: int = 8,
+		chunk_size: int = 256,
+		on_user_complete: Callable[[int, bool, ProcessingReport], None] = None
+	):
+		if workers < 1:
+			raise ValueError('workers must be at least 1')
+		if chunk_size < 1:
+			raise ValueError('chunk_size must be at least 1')
+		self.service = service
+		self.workers = workers
+		self.chunk_size = chunk_size
+		self.on_user_complete = on_user_complete
+		self.results: Dict[int, bool] = {}
+		self.reports: Dict[int, ProcessingReport] = {}
+		self.completion_times: Dict[int, float] = {}
+		self.makespan = 0.0
+		self.steal_count = 0
+
+	def run(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+		user_ids = list(user_ids)
+		self.results = {}
+		self.reports = {}
+		self.completion_times = {}
+		self.steal_count = 0
+		self._deques = [deque() for _ in range(self.workers)]
+		self._condition = threading.Condition()
+		self._outstanding = len(user_ids)
+		self._version = 0
+
+		# Workers pop from the right, so each deque is filled in reverse to
+		# start users in the order they were given.
+		for index in reversed(range(len(user_ids))):
+			user_id = user_ids[index]
+			self._deques[index % self.workers].append(lambda worker, user_id=user_id: self._fetch(worker, user_id))
+
+		self._run_started = self.service._clock()
+		threads = [
+			threading.Thread(target=self._work, args=(worker,), name=f'work-stealing-{worker}', daemon=True)
+			for worker in range(self.workers)
+		]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.makespan = self.service._clock() - self._run_started
+		return dict(self.results)
+
+	def completion_percentile(self, fraction: float) -> float:
+		return _percentile(list(self.completion_times.values()), fraction)
+
+	def _take(self, worker: int) -> Optional[Callable[[int], None]]:
+		try:
+			return self._deques[worker].pop()
+		except IndexError:
+			pass
+		# Thieves go to the most loaded worker first so every backlog shrinks
+		# at the same pace rather than one deque being emptied before the next.
+		deques = self._deques
+		for victim in sorted(range(self.workers), key=lambda index: len(deques[index]), reverse=True):
+			if victim == worker:
+				continue
+			try:
+				task = self._deques[victim].popleft()
+			except IndexError:
+				continue
+			with self._condition:
+				self.steal_count += 1
+			return task
+		return None
+
+	def _push(self, worker: int, tasks: List[Callable[[int], None]]) -> None:
+		# Chunks join the stealing end of the deque: the owner keeps starting
+		# the users already queued behind it while thieves take the chunks in
+		# order, and the owner only falls back to them once its queue is empty.
+		with self._condition:
+			self._outstanding += len(tasks)
+		self._deques[worker].extendleft(reversed(tasks))
+		with self._condition:
+			self._version += 1
+			self._condition.notify_all()
+
+	def _work(self, worker: int) -> None:
+		while True:
+			with self._condition:
+				version = self._version
+			task = self._take(worker)
+			if task is None:
+				with self._condition:
+					while self._outstanding and self._version == version:
+						self._condition.wait()
+					if not self._outstanding:
+						return
+				continue
+			try:
+				task(worker)
+			finally:
+				with self._condition:
+					self._outstanding -= 1
+					if not self._outstanding:
+						self._condition.notify_all()
+
+	def _fetch(self, worker: int, user_id: int) -> None:
+		service = self.service
+		report = ProcessingReport(user_id)
+		self.reports[user_id] = report
+		started = service._clock()
+		run = _UserRun(user_id, report, started, started + service.deadline if service.deadline is not None else None)
+		try:
+			orders = service.db_service.get_orders_by_user(user_id)
 		except Exception:
-			return False
\ No newline at end of file
+			orders = None
+		if not orders:
+			self._complete(run, False)
+			return
+
+		# Duplicates are resolved up front so no two chunks process the same
+		# record; their outcome is copied once the user has finished.
+		processed: Dict[Tuple[Any, ...], Order] = {}
+		unique = []
+		for order in orders:
+			key = (order.id, order.type, order.amount, order.flag)
+			original = processed.get(key)
+			if original is None:
+				processed[key] = order
+				unique.append(order)
+			else:
+				run.duplicates.append((order, original))
+		scheduled = list(service._schedule(unique))
+		chunks = [scheduled[start:start + self.chunk_size] for start in range(0, len(scheduled), self.chunk_size)]
+		run.pending_chunks = len(chunks)
+		if len(chunks) == 1:
+			self._run_chunk(run, chunks[0])
+			return
+		self._push(worker, [lambda worker, chunk=chunk: self._run_chunk(run, chunk) for chunk in chunks])
+
+	def _run_chunk(self, run: _UserRun, chunk: List[Order]) -> None:
+		service = self.service
+		report = run.report
+		service._local.deadline_at = run.deadline_at
+		try:
+			for position, order in enumerate(chunk):
+				if run.failed:
+					break
+				remaining = service._remaining_time()
+				if (remaining is not None and remaining <= 0) or not service._process_order(order, run.user_id):
+					with run.lock:
+						report.deadline_exceeded = True
+						for unprocessed in chunk[position:]:
+							unprocessed.status = 'deadline_exceeded'
+							report.unprocessed_order_ids.append(unprocessed.id)
+					break
+				elapsed = service._clock() - run.started
+				with run.lock:
+					report.record_completion(order.priority, elapsed)
+		except Exception:
+			run.failed = True
+		finally:
+			service._local.deadline_at = None
+
+		with run.lock:
+			run.pending_chunks -= 1
+			finished = run.pending_chunks == 0
+		if finished:
+			self._complete(run, not run.failed and not report.deadline_exceeded)
+
+	def _complete(self, run: _UserRun, result: bool) -> None:
+		report = run.report
+		for duplicate, original in run.duplicates:
+			duplicate.status = original.status
+			duplicate.priority = original.priority
+			if original.status == 'deadline_exceeded':
+				report.unprocessed_order_ids.append(duplicate.id)
+			else:
+				report.duplicate_count += 1
+		report.success = result
+		self.completion_times[run.user_id] = self.service._clock() - self._run_started
+		self.results[run.user_id] = result
+		if self.on_user_complete is not None:
+			self.on_user_complete(run.user_id, result, report)
+
+
+class PrefetchingDriver:
+	# Processes users one after another while a background thread fetches the
+	# orders of the next users, so fetch latency overlaps with processing.
+	# At most lookahead fetched users wait in the queue, plus one held by the
+	# fetcher until there is room. Results follow process_orders semantics.
+	def __init__(self, service: OrderProcessingService, lookahead: int = 2):
+		if lookahead < 1:
+			raise ValueError('lookahead must be at least 1')
+		self.service = service
+		self.lookahead = lookahead
+		self.fetch_wait = 0.0
+
+	def run(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+		queue = _lazy_import('queue')
+		fetched = queue.Queue(maxsize=self.lookahead)
+		stopping = threading.Event()
+		fetcher = threading.Thread(
+			target=self._fetch_ahead,
+			args=(list(user_ids), fetched, stopping),
+			name='order-prefetch',
+			daemon=True
+		)
+		fetcher.start()
+		clock = self.service._clock
+		results = {}
+		self.fetch_wait = 0.0
+		try:
+			while True:
+				waited = clock()
+				item = fetched.get()
+				self.fetch_wait += clock() - waited
+				if item is None:
+					return results
+				user_id, orders = item
+				results[user_id] = self.service._process_fetched_orders(user_id, lambda _: orders)
+		finally:
+			stopping.set()
+			fetcher.join()
+
+	def _fetch_ahead(self, user_ids: List[int], fetched: 'queue.Queue', stopping: threading.Event) -> None:
+		for user_id in user_ids:
+			try:
+				orders = self.service.db_service.get_orders_by_user(user_id)
+			except Exception:
+				# Reported as False, like a failed fetch in process_orders.
+				orders = None
+			if not self._put(fetched, (user_id, orders), stopping):
+				return
+		self._put(fetched, None, stopping)
+
+	def _put(self, fetched: 'queue.Queue', item: Any, stopping: threading.Event) -> bool:
+		queue = _lazy_import('queue')
+		while not stopping.is_set():
+			try:
+				fetched.put(item, timeout=0.05)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+
+def order_from_record(record: Dict[str, Any]) -> Tuple[int, Order]:
+	order = Order(record['id'], record['type'], record['amount'], record['flag'])
+	return record['user_id'], order
+
+
+class OrderSource(ABC):
+	# Records that could not be decoded are skipped and counted here.
+	rejected_count = 0
+
+	@abstractmethod
+	def poll(self, max_items: int, timeout: float) -> List[Tuple[int, Order]]:
+		pass
+
+	def close(self) -> None:
+		pass
+
+
+class QueueOrderSource(OrderSource):
+	def __init__(self, order_queue: 'queue.Queue' = None):
+		import queue
+
+		self.queue = order_queue or queue.Queue()
+
+	def put(self, user_id: int, order: Order) -> None:
+		self.queue.put((user_id, order))
+
+	def poll(self, max_items: int, timeout: float) -> List[Tuple[int, Order]]:
+		queue = _lazy_import('queue')
+		items = []
+		try:
+			items.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+			while len(items) < max_items:
+				items.append(self.queue.get_nowait())
+		except queue.Empty:
+			pass
+		return items
+
+
+class FileTailOrderSource(OrderSource):
+	def __init__(
+		self,
+		path: str,
+		poll_interval: float = 0.05,
+		clock: Callable[[], float] = time.monotonic,
+		sleep: Callable[[float], None] = time.sleep
+	):
+		self._file = open(path, 'r')
+		self._partial_line = ''
+		self.poll_interval = poll_interval
+		self._clock = clock
+		self._sleep = sleep
+
+	def poll(self, max_items: int, timeout: float) -> List[Tuple[int, Order]]:
+		json = _lazy_import('json')
+		items = []
+		deadline = self._clock() + timeout
+		while len(items) < max_items:
+			line = self._file.readline()
+			if line.endswith('\n'):
+				line, self._partial_line = self._partial_line + line, ''
+				if line.strip():
+					try:
+						items.append(order_from_record(json.loads(line)))
+					except (ValueError, KeyError, TypeError):
+						self.rejected_count += 1
+				continue
+
+			# Keep a half-written trailing line until its writer finishes it.
+			self._partial_line += line
+			remaining = deadline - self._clock()
+			if items or remaining <= 0:
+				break
+			self._sleep(min(self.poll_interval, remaining))
+		return items
+
+	def close(self) -> None:
+		self._file.close()
+
+
+class OrderStreamConsumer:
+	def __init__(
+		self,
+		service: OrderProcessingService,
+		source: OrderSource,
+		max_batch_size: int = 100,
+		max_batch_wait: float = 0.05,
+		clock: Callable[[], float] = time.monotonic
+	):
+		if max_batch_size < 1:
+			raise ValueError('max_batch_size must be at least 1')
+		if max_batch_wait <= 0:
+			raise ValueError('max_batch_wait must be positive')
+		self.service = service
+		self.source = source
+		self.max_batch_size = max_batch_size
+		self.max_batch_wait = max_batch_wait
+		self._clock = clock
+		self._stopping = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+		self.batch_count = 0
+		self.processed_count = 0
+		self._failed_orders = 0
+
+	def _next_batch(self) -> List[Tuple[int, Order]]:
+		batch = []
+		deadline = self._clock() + self.max_batch_wait
+		while len(batch) < self.max_batch_size and not self._stopping.is_set():
+			remaining = deadline - self._clock()
+			if remaining <= 0:
+				break
+			batch.extend(self.source.poll(self.max_batch_size - len(batch), remaining))
+		return batch
+
+	def _process_batch(self, batch: List[Tuple[int, Order]]) -> None:
+		if not batch:
+			return
+		self.batch_count += 1
+		for user_id, order in batch:
+			try:
+				self.service._process_order(order, user_id)
+				self.processed_count += 1
+			except Exception:
+				self._failed_orders += 1
+
+	@property
+	def failed_count(self) -> int:
+		return self._failed_orders + self.source.rejected_count
+
+	def run(self) -> None:
+		try:
+			while not self._stopping.is_set():
+				self._process_batch(self._next_batch())
+
+			# Drain what the source already holds so accepted work is not dropped.
+			while True:
+				batch = self.source.poll(self.max_batch_size, 0)
+				if not batch:
+					break
+				self._process_batch(batch)
+		finally:
+			self.source.close()
+
+	def start(self) -> None:
+		self._thread = threading.Thread(target=self.run, name='order-stream-consumer', daemon=True)
+		self._thread.start()
+
+	def stop(self, timeout: float = None) -> None:
+		self._stopping.set()
+		if self._thread is not None:
+			self._thread.join(timeout)
+
+
+class InMemoryDatabaseService(DatabaseService):
+	def __init__(self, orders_by_user: Dict[int, List[Order]] = None):
+		self.orders_by_user = orders_by_user if orders_by_user is not None else {}
+		self.updates: Dict[int, Tuple[str, str]] = {}
+		self._lock = threading.Lock()
+
+	def add_order(self, user_id: int, order: Order) -> None:
+		self.orders_by_user.setdefault(user_id, []).append(order)
+
+	def get_orders_by_user(self, user_id: int) -> List[Order]:
+		return list(self.orders_by_user.get(user_id, []))
+
+	def update_order_status(self, order_id: int, status: str, priority: str) -> bool:
+		with self._lock:
+			self.updates[order_id] = (status, priority)
+		return True
+
+
+class SyntheticAPIClient(APIClient):
+	def __init__(self, seed: int = 0, success_ratio: float = 0.9, failure_ratio: float = 0.05):
+		self.seed = seed
+		self.success_ratio = success_ratio
+		self.failure_ratio = failure_ratio
+
+	def call_api(self, order_id: int) -> APIResponse:
+		# Seeded per order id so reruns and concurrent callers see the same answer.
+		rng = _lazy_import('random').Random(self.seed * 1000003 + order_id)
+		roll = rng.random()
+		if roll < self.failure_ratio:
+			raise APIException(f'synthetic failure for order {order_id}')
+		if roll < self.failure_ratio + self.success_ratio:
+			return APIResponse('success', rng.randrange(100))
+		return APIResponse('error', None)
+
+
+class ScriptedLatencyAPIClient(APIClient):
+	# Local fake API whose latency is latency(seconds since construction,
+	# calls in flight including this one), for driving latency-sensitive
+	# wrappers through load shifts and overload. Calls slower than
+	# error_above raise APIException once their latency has elapsed.
+	def __init__(
+		self,
+		latency: Callable[[float, int], float],
+		error_above: float = None,
+		clock: Callable[[], float] = time.monotonic,
+		sleep: Callable[[float], None] = time.sleep
+	):
+		self.latency = latency
+		self.error_above = error_above
+		self._clock = clock
+		self._sleep = sleep
+		self._started = clock()
+		self._lock = threading.Lock()
+		self.in_flight = 0
+		self.calls = 0
+
+	def call_api(self, order_id: int) -> APIResponse:
+		with self._lock:
+			self.in_flight += 1
+			self.calls += 1
+			in_flight = self.in_flight
+		try:
+			latency = self.latency(self._clock() - self._started, in_flight)
+			self._sleep(latency)
+		finally:
+			with self._lock:
+				self.in_flight -= 1
+		if self.error_above is not None and latency > self.error_above:
+			raise APIException(f'scripted overload for order {order_id}')
+		return APIResponse('success', order_id % 100)
+
+
+class RecordingAPIClient(APIClient):
+	# Appends one compact JSON array per call:
+	# [order_id, 'r', status, data, latency] or [order_id, 'x', message, null, latency].
+	def __init__(self, api_client: APIClient, path: str, clock: Callable[[], float] = time.perf_counter):
+		self.api_client = api_client
+		self._file = open(path, 'a')
+		self._clock = clock
+		self._lock = threading.Lock()
+
+	def _append(self, entry: list) -> None:
+		line = _lazy_import('json').dumps(entry, separators=(',', ':'), default=repr)
+		with self._lock:
+			self._file.write(line + '\n')
+
+	def call_api(self, order_id: int) -> APIResponse:
+		started = self._clock()
+		try:
+			response = self.api_client.call_api(order_id)
+		except APIException as exc:
+			self._append([order_id, 'x', str(exc), None, self._clock() - started])
+			raise
+		self._append([order_id, 'r', response.status, response.data, self._clock() - started])
+		return response
+
+	def flush(self) -> None:
+		with self._lock:
+			self._file.flush()
+
+	def close(self) -> None:
+		with self._lock:
+			self._file.close()
+
+
+class ReplayAPIClient(APIClient):
+	def __init__(self, path: str, replay_latency: bool = False, sleep: Callable[[float], None] = time.sleep):
+		import json
+
+		self.replay_latency = replay_latency
+		self._sleep = sleep
+		self._entries: Dict[int, List[Tuple[str, Any, Any, float]]] = {}
+		self._cursors: Dict[int, int] = {}
+		self._lock = threading.Lock()
+		with open(path) as file_handle:
+			for line in file_handle:
+				if line.strip():
+					order_id, kind, value, data, latency = json.loads(line)
+					self._entries.setdefault(order_id, []).append((kind, value, data, latency))
+
+	def call_api(self, order_id: int) -> APIResponse:
+		entries = self._entries.get(order_id)
+		if not entries:
+			raise APIException(f'no recorded response for order {order_id}')
+
+		# Repeated calls walk through the recording and then stick to the last answer.
+		with self._lock:
+			cursor = self._cursors.get(order_id, 0)
+			self._cursors[order_id] = min(cursor + 1, len(entries) - 1)
+		kind, value, data, latency = entries[cursor]
+
+		if self.replay_latency:
+			self._sleep(latency)
+		if kind == 'x':
+			raise APIException(value)
+		return APIResponse(value, data)
+
+
+class IOCounters:
+	# Shared tally for the Counting* wrappers: calls per operation name plus
+	# the files opened and bytes written through wrap_file.
+	def __init__(self):
+		self.calls: Counter = Counter()
+		self.files_opened = 0
+		self.bytes_written = 0
+		self._lock = threading.Lock()
+
+	def count(self, operation: str, amount: int = 1) -> None:
+		with self._lock:
+			self.calls[operation] += amount
+
+	def wrap_file(self, file_handle: Any) -> '_CountingFile':
+		with self._lock:
+			self.files_opened += 1
+		return _CountingFile(file_handle, self)
+
+	def _written(self, size: int) -> None:
+		with self._lock:
+			self.bytes_written += size
+
+	def snapshot(self) -> Dict[str, Any]:
+		with self._lock:
+			return {
+				'calls': dict(self.calls),
+				'files_opened': self.files_opened,
+				'bytes_written': self.bytes_written
+			}
+
+
+class _CountingFile:
+	def __init__(self, file_handle: Any, counters: IOCounters):
+		self._file = file_handle
+		self._counters = counters
+		self._encoding = getattr(file_handle, 'encoding', None) or 'utf-8'
+
+	def write(self, data: Union[str, bytes]) -> int:
+		self._counters._written(len(data.encode(self._encoding)) if isinstance(data, str) else len(data))
+		return self._file.write(data)
+
+	def writelines(self, lines: Iterable[Union[str, bytes]]) -> None:
+		for line in lines:
+			self.write(line)
+
+	def __getattr__(self, name: str) -> Any:
+		return getattr(self._file, name)
+
+	def __enter__(self) -> '_CountingFile':
+		return self
+
+	def __exit__(self, *exc_info: Any) -> None:
+		self._file.close()
+
+
+class CountingDatabaseService(DatabaseService):
+	def __init__(self, db_service: DatabaseService, counters: IOCounters = None):
+		self.db_service = db_service
+		self.counters = counters or IOCounters()
+
+	def get_orders_by_user(self, user_id: int) -> List[Order]:
+		self.counters.count('get_orders_by_user')
+		return self.db_service.get_orders_by_user(user_id)
+
+	def get_orders_by_users(self, user_ids: Iterable[int]) -> Dict[int, List[Order]]:
+		self.counters.count('get_orders_by_users')
+		return self.db_service.get_orders_by_users(user_ids)
+
+	def update_order_status(self, order_id: int, status: str, priority: str) -> bool:
+		self.counters.count('update_order_status')
+		return self.db_service.update_order_status(order_id, status, priority)
+
+	def update_order_statuses(self, updates: List[Tuple[int, str, str]]) -> List[Any]:
+		self.counters.count('update_order_statuses')
+		return self.db_service.update_order_statuses(updates)
+
+
+class CountingAPIClient(APIClient):
+	def __init__(self, api_client: APIClient, counters: IOCounters = None):
+		self.api_client = api_client
+		self.counters = counters or IOCounters()
+
+	def call_api(self, order_id: int) -> APIResponse:
+		self.counters.count('call_api')
+		return self.api_client.call_api(order_id)
+
+	def call_api_batch(self, order_ids: List[int]) -> List[Any]:
+		self.counters.count('call_api_batch')
+		return self.api_client.call_api_batch(order_ids)
+
+
+class CountingOrderExporter:
+	# Counts export calls and exports through a shallow copy of the given
+	# exporter whose opener, chained on top of any it already had, tallies
+	# every export file and byte. The caller's exporter is left untouched, so
+	# wrapping it again does not count the same bytes twice.
+	def __init__(self, order_exporter: OrderExporter, counters: IOCounters = None):
+		self.counters = counters or IOCounters()
+		inner_opener = order_exporter.opener or open
+		self.order_exporter = copy.copy(order_exporter)
+		self.order_exporter.opener = lambda *args, **kwargs: self.counters.wrap_file(inner_opener(*args, **kwargs))
+
+	def export_order_to_csv(self, order: Order, user_id: int) -> str:
+		self.counters.count('export_order_to_csv')
+		return self.order_exporter.export_order_to_csv(order, user_id)
+
+	def __getattr__(self, name: str) -> Any:
+		return getattr(self.order_exporter, name)
+
+
+def uniform_amounts(low: float = 1.0, high: float = 400.0) -> Callable[['random.Random'], float]:
+	return lambda rng: round(rng.uniform(low, high), 2)
+
+
+def lognormal_amounts(mu: float = 4.5, sigma: float = 0.8) -> Callable[['random.Random'], float]:
+	return lambda rng: round(rng.lognormvariate(mu, sigma), 2)
+
+
+class OrderDatasetGenerator:
+	def __init__(
+		self,
+		seed: int = 0,
+		type_mix: Dict[str, float] = None,
+		amount_distribution: Callable[['random.Random'], float] = None,
+		flag_ratio: float = 0.5,
+		orders_per_user: int = 100,
+		api_success_ratio: float = 0.9,
+		api_failure_ratio: float = 0.05
+	):
+		type_mix = type_mix or {'A': 1.0, 'B': 1.0, 'C': 1.0}
+		if orders_per_user < 1:
+			raise ValueError('orders_per_user must be at least 1')
+		if any(weight < 0 for weight in type_mix.values()) or sum(type_mix.values()) <= 0:
+			raise ValueError('type_mix weights must be non-negative and not all zero')
+		self.seed = seed
+		self.types = list(type_mix)
+		total = sum(type_mix.values())
+		self._cumulative_weights = []
+		running = 0.0
+		for order_type in self.types:
+			running += type_mix[order_type] / total
+			self._cumulative_weights.append(running)
+		self.amount_distribution = amount_distribution or uniform_amounts()
+		self.flag_ratio = flag_ratio
+		self.orders_per_user = orders_per_user
+		self.api_success_ratio = api_success_ratio
+		self.api_failure_ratio = api_failure_ratio
+
+	def iter_orders(self, count: int) -> Iterator[Tuple[int, Order]]:
+		import random
+
+		rng = random.Random(self.seed)
+		last_type = len(self.types) - 1
+		for index in range(count):
+			type_index = min(bisect.bisect_right(self._cumulative_weights, rng.random()), last_type)
+			order = Order(
+				index + 1,
+				self.types[type_index],
+				self.amount_distribution(rng),
+				rng.random() < self.flag_ratio
+			)
+			yield index // self.orders_per_user + 1, order
+
+	def orders_by_user(self, count: int) -> Dict[int, List[Order]]:
+		return group_orders_by_user(self.iter_orders(count))
+
+	def api_client(self) -> SyntheticAPIClient:
+		return SyntheticAPIClient(self.seed, self.api_success_ratio, self.api_failure_ratio)
+
+
+def group_orders_by_user(records: Iterable[Tuple[int, Order]]) -> Dict[int, List[Order]]:
+	orders_by_user = {}
+	for user_id, order in records:
+		orders_by_user.setdefault(user_id, []).append(order)
+	return orders_by_user
+
+
+ORDERS_FILE_MAGIC = b'ORD1'
+
+ORDER_RECORD = struct.Struct('<qqcd?')
+
+ORDERS_FILE_CHUNK_RECORDS = 65536
+
+
+def _order_type_code(order: Order) -> bytes:
+	type_code = order.type.encode('ascii') if isinstance(order.type, str) else b''
+	if len(type_code) != 1:
+		raise ValueError(f'order {order.id} has a type that does not fit one byte: {order.type!r}')
+	return type_code
+
+
+def _write_record_chunks(file_handle, packed_records: Iterable[bytes]) -> int:
+	count = 0
+	chunk = []
+	for packed in packed_records:
+		chunk.append(packed)
+		if len(chunk) == ORDERS_FILE_CHUNK_RECORDS:
+			file_handle.write(b''.join(chunk))
+			count += len(chunk)
+			chunk = []
+	file_handle.write(b''.join(chunk))
+	return count + len(chunk)
+
+
+def write_orders_file(path: str, records: Iterable[Tuple[int, Order]]) -> int:
+	pack = ORDER_RECORD.pack
+	with open(path, 'wb') as file_handle:
+		file_handle.write(ORDERS_FILE_MAGIC)
+		return _write_record_chunks(file_handle, (
+			pack(user_id, order.id, _order_type_code(order), order.amount, bool(order.flag))
+			for user_id, order in records
+		))
+
+
+def read_orders_file(path: str) -> Iterator[Tuple[int, Order]]:
+	with open(path, 'rb') as file_handle:
+		if file_handle.read(len(ORDERS_FILE_MAGIC)) != ORDERS_FILE_MAGIC:
+			raise ValueError(f'{path} is not an orders file')
+		while True:
+			block = file_handle.read(ORDER_RECORD.size * ORDERS_FILE_CHUNK_RECORDS)
+			if not block:
+				return
+			if len(block) % ORDER_RECORD.size:
+				raise ValueError(f'{path} ends with a truncated record')
+			for user_id, order_id, type_code, amount, flag in ORDER_RECORD.iter_unpack(block):
+				yield user_id, Order(order_id, type_code.decode('ascii'), amount, flag)
+
+
+def load_orders_file(path: str) -> Dict[int, List[Order]]:
+	import json
+
+	with open(path, 'rb') as file_handle:
+		magic = file_handle.read(len(ORDERS_FILE_MAGIC))
+	if magic == ORDERS_FILE_MAGIC:
+		return group_orders_by_user(read_orders_file(path))
+	if magic == MAPPED_ORDERS_MAGIC:
+		return group_orders_by_user(read_mapped_orders_file(path))
+
+	with open(path) as file_handle:
+		return group_orders_by_user(
+			order_from_record(json.loads(line)) for line in file_handle if line.strip()
+		)
+
+
+MAPPED_ORDERS_MAGIC = b'ORM2'
+
+MAPPED_ORDERS_HEADER = struct.Struct('<4s4xQQQQ8x')
+
+MAPPED_ORDER_RECORD = struct.Struct('<qqd1s?18s4s')
+
+MAPPED_ORDERS_INDEX_ENTRY = struct.Struct('<qQQ')
+
+MAPPED_ORDERS_ID_INDEX_ENTRY = struct.Struct('<qQ')
+
+MAPPED_ORDERS_SORT_RUN_RECORDS = 1 << 20
+
+_MAPPED_ORDERS_MERGE_BLOCK_RECORDS = 4096
+
+_MAPPED_ORDER_ID = struct.Struct('<q')
+
+_MAPPED_ORDER_AMOUNT = struct.Struct('<d')
+
+_MAPPED_ORDER_STATE = struct.Struct('<18s4s')
+
+_MAPPED_ORDER_STATE_OFFSET = 26
+
+
+def _encode_mapped_field(value: str, size: int) -> bytes:
+	encoded = value.encode('ascii')
+	if len(encoded) > size:
+		raise ValueError(f'{value!r} does not fit in {size} bytes')
+	return encoded
+
+
+def _decode_mapped_field(value: bytes) -> str:
+	return value.rstrip(b'\0').decode('ascii')
+
+
+def _spill_sorted_run(spill_file, run: List[Tuple[int, int]], runs: List[Tuple[int, int]]) -> None:
+	run.sort()
+	spill_file.seek(0, os.SEEK_END)
+	runs.append((spill_file.tell(), len(run)))
+	id_pack = MAPPED_ORDERS_ID_INDEX_ENTRY.pack
+	spill_file.write(b''.join(id_pack(order_id, position) for order_id, position in run))
+	run.clear()
+
+
+def _read_sorted_run(spill_file, offset: int, count: int) -> Iterator[Tuple[int, int]]:
+	# Runs share one spill file, so every block read seeks to its own offset.
+	end = offset + count * MAPPED_ORDERS_ID_INDEX_ENTRY.size
+	while offset < end:
+		spill_file.seek(offset)
+		block = spill_file.read(min(end - offset, _MAPPED_ORDERS_MERGE_BLOCK_RECORDS * MAPPED_ORDERS_ID_INDEX_ENTRY.size))
+		offset += len(block)
+		yield from MAPPED_ORDERS_ID_INDEX_ENTRY.iter_unpack(block)
+
+
+def write_mapped_orders_file(
+	path: str,
+	records: Iterable[Tuple[int, Order]],
+	sort_run_records: int = MAPPED_ORDERS_SORT_RUN_RECORDS
+) -> int:
+	# Records must arrive grouped by user so each user maps to one contiguous
+	# range. The per-user index and an order-id index sorted by id (for
+	# update_order_status lookups) are appended after the records. The id
+	# index is sorted externally: runs of at most sort_run_records ids are
+	# sorted, spilled to a temporary file and merged, so memory stays bounded
+	# whatever the number of orders.
+	import tempfile
+
+	index = []
+	seen_users = set()
+	run = []
+	runs = []
+	ids_sorted = True
+	pack = MAPPED_ORDER_RECORD.pack
+	with open(path, 'wb') as file_handle, tempfile.TemporaryFile() as spill_file:
+		def packed_records() -> Iterator[bytes]:
+			nonlocal ids_sorted
+			last_id = None
+			for position, (user_id, order) in enumerate(records):
+				if not index or index[-1][0] != user_id:
+					if user_id in seen_users:
+						raise ValueError(f'records for user {user_id} are not contiguous')
+					seen_users.add(user_id)
+					index.append([user_id, position, 0])
+				index[-1][2] += 1
+				if last_id is not None and order.id < last_id:
+					ids_sorted = False
+				last_id = order.id
+				run.append((order.id, position))
+				if len(run) == sort_run_records:
+					_spill_sorted_run(spill_file, run, runs)
+				yield pack(
+					user_id,
+					order.id,
+					order.amount,
+					_order_type_code(order),
+					bool(order.flag),
+					_encode_mapped_field(order.status, 18),
+					_encode_mapped_field(order.priority, 4)
+				)
+
+		file_handle.write(MAPPED_ORDERS_HEADER.pack(MAPPED_ORDERS_MAGIC, 0, 0, 0, 0))
+		count = _write_record_chunks(file_handle, packed_records())
+
+		index_offset = file_handle.tell()
+		file_handle.write(b''.join(MAPPED_ORDERS_INDEX_ENTRY.pack(*entry) for entry in index))
+
+		id_index_offset = file_handle.tell()
+		if runs:
+			if run:
+				_spill_sorted_run(spill_file, run, runs)
+			sorted_runs = [_read_sorted_run(spill_file, offset, run_count) for offset, run_count in runs]
+			# Runs of ids that arrived sorted are already in order end to end.
+			entries = itertools.chain.from_iterable(sorted_runs) if ids_sorted else heapq.merge(*sorted_runs)
+		else:
+			run.sort()
+			entries = run
+		id_pack = MAPPED_ORDERS_ID_INDEX_ENTRY.pack
+		_write_record_chunks(file_handle, (id_pack(order_id, position) for order_id, position in entries))
+
+		file_handle.seek(0)
+		file_handle.write(MAPPED_ORDERS_HEADER.pack(MAPPED_ORDERS_MAGIC, count, index_offset, len(index), id_index_offset))
+	return count
+
+
+def read_mapped_orders_file(path: str) -> Iterator[Tuple[int, Order]]:
+	with open(path, 'rb') as file_handle:
+		magic, count = MAPPED_ORDERS_HEADER.unpack(file_handle.read(MAPPED_ORDERS_HEADER.size))[:2]
+		if magic != MAPPED_ORDERS_MAGIC:
+			raise ValueError(f'{path} is not a mapped orders file')
+		while count:
+			block_records = min(count, ORDERS_FILE_CHUNK_RECORDS)
+			block = file_handle.read(MAPPED_ORDER_RECORD.size * block_records)
+			if len(block) != MAPPED_ORDER_RECORD.size * block_records:
+				raise ValueError(f'{path} ends with a truncated record')
+			for user_id, order_id, amount, type_code, flag, status, priority in MAPPED_ORDER_RECORD.iter_unpack(block):
+				order = Order(order_id, type_code.decode('ascii'), amount, flag)
+				order.status = _decode_mapped_field(status)
+				order.priority = _decode_mapped_field(priority)
+				yield user_id, order
+			count -= block_records
+
+
+class MappedOrder(Order):
+	# A view over one record of a memory-mapped orders file. Fields are decoded
+	# on access; status and priority changes stay local until the database
+	# service writes them back.
+	def __init__(self, buffer: 'mmap.mmap', offset: int):
+		self._buffer = buffer
+		self._offset = offset
+		self._status = None
+		self._priority = None
+
+	@property
+	def id(self) -> int:
+		return _MAPPED_ORDER_ID.unpack_from(self._buffer, self._offset + 8)[0]
+
+	@property
+	def amount(self) -> float:
+		return _MAPPED_ORDER_AMOUNT.unpack_from(self._buffer, self._offset + 16)[0]
+
+	@property
+	def type(self) -> str:
+		return chr(self._buffer[self._offset + 24])
+
+	@property
+	def flag(self) -> bool:
+		return self._buffer[self._offset + 25] != 0
+
+	@property
+	def status(self) -> str:
+		if self._status is None:
+			return _decode_mapped_field(_MAPPED_ORDER_STATE.unpack_from(self._buffer, self._offset + _MAPPED_ORDER_STATE_OFFSET)[0])
+		return self._status
+
+	@status.setter
+	def status(self, value: str) -> None:
+		self._status = value
+
+	@property
+	def priority(self) -> str:
+		if self._priority is None:
+			return _decode_mapped_field(_MAPPED_ORDER_STATE.unpack_from(self._buffer, self._offset + _MAPPED_ORDER_STATE_OFFSET)[1])
+		return self._priority
+
+	@priority.setter
+	def priority(self, value: str) -> None:
+		self._priority = value
+
+
+class MappedOrderSlice(Sequence):
+	def __init__(self, buffer: 'mmap.mmap', first: int, count: int):
+		self._buffer = buffer
+		self._first = first
+		self._count = count
+
+	def __len__(self) -> int:
+		return self._count
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			start, stop, step = index.indices(self._count)
+			if step != 1:
+				return [self[position] for position in range(start, stop, step)]
+			return MappedOrderSlice(self._buffer, self._first + start, max(0, stop - start))
+		if index < 0:
+			index += self._count
+		if not 0 <= index < self._count:
+			raise IndexError('order index out of range')
+		offset = MAPPED_ORDERS_HEADER.size + (self._first + index) * MAPPED_ORDER_RECORD.size
+		return MappedOrder(self._buffer, offset)
+
+
+class MmapDatabaseService(DatabaseService):
+	def __init__(self, path: str):
+		import mmap
+
+		self._file = open(path, 'r+b')
+		self._mmap = mmap.mmap(self._file.fileno(), 0)
+		magic, self.record_count, index_offset, user_count, self._id_index_offset = \
+			MAPPED_ORDERS_HEADER.unpack_from(self._mmap, 0)
+		if magic != MAPPED_ORDERS_MAGIC:
+			self.close()
+			raise ValueError(f'{path} is not a mapped orders file')
+
+		self._user_ranges = {}
+		for position in range(user_count):
+			user_id, first, count = MAPPED_ORDERS_INDEX_ENTRY.unpack_from(
+				self._mmap, index_offset + position * MAPPED_ORDERS_INDEX_ENTRY.size
+			)
+			self._user_ranges[user_id] = (first, count)
+
+	def get_orders_by_user(self, user_id: int) -> List[Order]:
+		first, count = self._user_ranges.get(user_id, (0, 0))
+		return MappedOrderSlice(self._mmap, first, count)
+
+	def _record_positions(self, order_id: int) -> List[int]:
+		# Binary search over the on-disk order-id index, so lookups need no
+		# memory beyond the mapping whatever the number of orders.
+		entry_size = MAPPED_ORDERS_ID_INDEX_ENTRY.size
+		low, high = 0, self.record_count
+		while low < high:
+			middle = (low + high) // 2
+			if _MAPPED_ORDER_ID.unpack_from(self._mmap, self._id_index_offset + middle * entry_size)[0] < order_id:
+				low = middle + 1
+			else:
+				high = middle
+
+		positions = []
+		while low < self.record_count:
+			entry_id, position = MAPPED_ORDERS_ID_INDEX_ENTRY.unpack_from(self._mmap, self._id_index_offset + low * entry_size)
+			if entry_id != order_id:
+				break
+			positions.append(position)
+			low += 1
+		return positions
+
+	def update_order_status(self, order_id: int, status: str, priority: str) -> bool:
+		positions = self._record_positions(order_id)
+		if not positions:
+			raise DatabaseException(f'order {order_id} is not in the mapped orders file')
+		try:
+			state = (_encode_mapped_field(status, 18), _encode_mapped_field(priority, 4))
+		except ValueError as exc:
+			raise DatabaseException(str(exc))
+		for position in positions:
+			offset = MAPPED_ORDERS_HEADER.size + position * MAPPED_ORDER_RECORD.size + _MAPPED_ORDER_STATE_OFFSET
+			_MAPPED_ORDER_STATE.pack_into(self._mmap, offset, *state)
+		return True
+
+	def flush(self) -> None:
+		self._mmap.flush()
+
+	def close(self) -> None:
+		if not self._mmap.closed:
+			self._mmap.close()
+		self._file.close()
+
+	def __enter__(self) -> 'MmapDatabaseService':
+		return self
+
+	def __exit__(self, *exc_info) -> None:
+		self.close()
+
+
+def profile_process_orders(
+	build_service: Callable[[], OrderProcessingService],
+	user_ids: List[int],
+	top: int = 20,
+	pstats_path: str = None,
+	stream=None
+) -> 'pstats.Stats':
+	import cProfile
+	import pstats
+	import tracemalloc
+
+	stream = stream or sys.stdout
+
+	# cProfile and tracemalloc distort each other, so each gets its own run
+	# against a freshly built service.
+	service = build_service()
+	profiler = cProfile.Profile()
+	profiler.enable()
+	for user_id in user_ids:
+		service.process_orders(user_id)
+	profiler.disable()
+
+	service = build_service()
+	tracemalloc.start()
+	for user_id in user_ids:
+		service.process_orders(user_id)
+	snapshot = tracemalloc.take_snapshot()
+	tracemalloc.stop()
+
+	stats = pstats.Stats(profiler, stream=stream)
+	stats.sort_stats('cumulative').print_stats(top)
+	if pstats_path:
+		stats.dump_stats(pstats_path)
+		print(f'pstats written to {pstats_path}', file=stream)
+
+	print(f'Top {top} allocation sites:', file=stream)
+	for statistic in snapshot.statistics('lineno')[:top]:
+		print(statistic, file=stream)
+	return stats
+
+
+def main(argv: List[str] = None) -> int:
+	import argparse
+	import tempfile
+
+	parser = argparse.ArgumentParser(prog='python -m exam')
+	subparsers = parser.add_subparsers(dest='command', required=True)
+
+	profile_parser = subparsers.add_parser('profile', help='run process_orders under cProfile and tracemalloc')
+	profile_parser.add_argument('--orders-file', help='orders file (binary, mapped or newline-delimited JSON) to use instead of synthetic data')
+	profile_parser.add_argument('--users', type=int, default=10)
+	profile_parser.add_argument('--orders-per-user', type=int, default=1000)
+	profile_parser.add_argument('--seed', type=int, default=0)
+	profile_parser.add_argument('--top', type=int, default=20)
+	profile_parser.add_argument('--pstats', default='process_orders.pstats')
+	profile_parser.add_argument('--api-recording', help='serve call_api from a RecordingAPIClient file instead of synthetic responses')
+	profile_parser.add_argument('--replay-latency', action='store_true', help='re-inject recorded call_api latencies')
+	profile_parser.add_argument('--export-dir', help='directory for Type A CSV exports (defaults to a temporary directory)')
+
+	generate_parser = subparsers.add_parser('generate', help='write a seeded synthetic orders file')
+	generate_parser.add_argument('output')
+	generate_parser.add_argument('--count', type=int, default=1000000)
+	generate_parser.add_argument('--orders-per-user', type=int, default=100)
+	generate_parser.add_argument('--seed', type=int, default=0)
+	generate_parser.add_argument('--type-mix', default='A=1,B=1,C=1', help='comma-separated TYPE=WEIGHT pairs')
+	generate_parser.add_argument('--flag-ratio', type=float, default=0.5)
+	generate_parser.add_argument('--format', choices=('records', 'mapped'), default='records', help='mapped files can back MmapDatabaseService')
+
+	args = parser.parse_args(argv)
+
+	if args.command == 'generate':
+		type_mix = {}
+		for pair in args.type_mix.split(','):
+			order_type, weight = pair.split('=')
+			type_mix[order_type] = float(weight)
+		generator = OrderDatasetGenerator(
+			args.seed,
+			type_mix=type_mix,
+			flag_ratio=args.flag_ratio,
+			orders_per_user=args.orders_per_user
+		)
+		write = write_mapped_orders_file if args.format == 'mapped' else write_orders_file
+		count = write(args.output, generator.iter_orders(args.count))
+		print(f'wrote {count} orders to {args.output}')
+		return 0
+
+	generator = OrderDatasetGenerator(args.seed, orders_per_user=args.orders_per_user)
+
+	if args.orders_file:
+		dataset = load_orders_file(args.orders_file)
+	else:
+		dataset = generator.orders_by_user(args.users * args.orders_per_user)
+
+	# The dataset is read once; each run gets fresh Order objects because
+	# process_orders mutates their status and priority.
+	fields_by_user = {
+		user_id: [(order.id, order.type, order.amount, order.flag) for order in orders]
+		for user_id, orders in dataset.items()
+	}
+	del dataset
+
+	def fresh_orders() -> Dict[int, List[Order]]:
+		return {
+			user_id: [Order(*order_fields) for order_fields in orders]
+			for user_id, orders in fields_by_user.items()
+		}
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+		export_dir = args.export_dir or temp_dir
+
+		def build_service() -> OrderProcessingService:
+			if args.api_recording:
+				api_client = ReplayAPIClient(args.api_recording, args.replay_latency)
+			else:
+				api_client = generator.api_client()
+			return OrderProcessingService(
+				InMemoryDatabaseService(fresh_orders()),
+				api_client,
+				OrderExporter(export_dir)
+			)
+
+		profile_process_orders(build_service, sorted(fields_by_user), args.top, args.pstats)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,168 @@
+import math
+
+import pytest
+from exam import (
+    CountingAPIClient,
+    CountingDatabaseService,
+    CountingOrderExporter,
+    InMemoryDatabaseService,
+    IOCounters,
+    Order,
+    OrderDatasetGenerator,
+    OrderExporter,
+    OrderProcessingService,
+    PrefetchingDriver,
+    SyntheticAPIClient,
+    WorkStealingScheduler
+)
+
+
+# I/O allowed per unit of work. Exceeding any of these is a regression in the
+# I/O pattern even when every order still ends with the right status.
+MAX_FETCHES_PER_USER = 1
+MAX_STATUS_UPDATES_PER_ORDER = 1
+MAX_API_CALLS_PER_TYPE_B_ORDER = 1
+MAX_FILES_PER_TYPE_A_ORDER = 1
+MAX_BYTES_PER_EXPORT = 100
+
+ORDERS = 400
+ORDERS_PER_USER = 50
+
+TYPE_MIXES = {
+    'only_a': {'A': 1.0},
+    'only_b': {'B': 1.0},
+    'only_c': {'C': 1.0},
+    'even': {'A': 1.0, 'B': 1.0, 'C': 1.0},
+    'b_heavy': {'A': 1.0, 'B': 8.0, 'C': 1.0}
+}
+
+
+def _instrumented_service(tmp_path, orders_by_user: dict, fast_csv: bool = False):
+    counters = IOCounters()
+    service = OrderProcessingService(
+        CountingDatabaseService(InMemoryDatabaseService(orders_by_user), counters),
+        CountingAPIClient(SyntheticAPIClient(seed=5), counters),
+        CountingOrderExporter(OrderExporter(str(tmp_path), fast_csv=fast_csv), counters)
+    )
+    return service, counters
+
+
+def _orders_by_user(type_mix: dict) -> dict:
+    return OrderDatasetGenerator(seed=5, type_mix=type_mix, orders_per_user=ORDERS_PER_USER).orders_by_user(ORDERS)
+
+
+def _type_counts(orders_by_user: dict) -> dict:
+    counts = {'A': 0, 'B': 0, 'C': 0}
+    for orders in orders_by_user.values():
+        for order in orders:
+            counts[order.type] += 1
+    return counts
+
+
+def _assert_within_budget(counters: IOCounters, users: int, orders: int, type_counts: dict) -> None:
+    calls = counters.snapshot()['calls']
+    assert set(calls) <= {'get_orders_by_user', 'update_order_status', 'call_api', 'export_order_to_csv'}
+    assert calls.get('get_orders_by_user', 0) <= MAX_FETCHES_PER_USER * users
+    assert calls.get('update_order_status', 0) <= MAX_STATUS_UPDATES_PER_ORDER * orders
+    assert calls.get('call_api', 0) <= MAX_API_CALLS_PER_TYPE_B_ORDER * type_counts['B']
+    assert counters.files_opened <= MAX_FILES_PER_TYPE_A_ORDER * type_counts['A']
+    assert counters.bytes_written <= MAX_BYTES_PER_EXPORT * type_counts['A']
+
+
+@pytest.mark.parametrize('mix', sorted(TYPE_MIXES))
+def test_should_stay_within_io_budget_per_order_for_type_mix(tmp_path, mix: str) -> None:
+    # Arrange
+    orders_by_user = _orders_by_user(TYPE_MIXES[mix])
+    service, counters = _instrumented_service(tmp_path, orders_by_user)
+
+    # Act
+    results = [service.process_orders(user_id) for user_id in orders_by_user]
+
+    # Assert
+    assert all(results)
+    _assert_within_budget(counters, len(orders_by_user), ORDERS, _type_counts(orders_by_user))
+
+
+@pytest.mark.parametrize('fast_csv', [False, True])
+def test_should_write_same_export_bytes_with_either_csv_encoder(tmp_path, fast_csv: bool) -> None:
+    # Arrange
+    orders_by_user = _orders_by_user({'A': 1.0})
+    service, counters = _instrumented_service(tmp_path, orders_by_user, fast_csv=fast_csv)
+
+    # Act
+    for user_id in orders_by_user:
+        service.process_orders(user_id)
+
+    # Assert
+    assert counters.files_opened == ORDERS
+    assert counters.bytes_written == sum(path.stat().st_size for path in tmp_path.glob('*.csv'))
+    assert counters.bytes_written <= MAX_BYTES_PER_EXPORT * ORDERS
+
+
+def test_should_not_spend_io_on_repeated_records(tmp_path) -> None:
+    # Arrange
+    unique = _orders_by_user(TYPE_MIXES['even'])
+    orders_by_user = {
+        user_id: orders + [Order(order.id, order.type, order.amount, order.flag) for order in orders]
+        for user_id, orders in unique.items()
+    }
+    service, counters = _instrumented_service(tmp_path, orders_by_user)
+
+    # Act
+    for user_id in orders_by_user:
+        service.process_orders(user_id)
+
+    # Assert
+    _assert_within_budget(counters, len(unique), ORDERS, _type_counts(unique))
+
+
+@pytest.mark.parametrize('group_size', [1, 3, 100])
+def test_should_fetch_once_per_group_when_processing_users_in_bulk(tmp_path, group_size: int) -> None:
+    # Arrange
+    orders_by_user = _orders_by_user(TYPE_MIXES['even'])
+    service, counters = _instrumented_service(tmp_path, orders_by_user)
+
+    # Act
+    service.process_users(list(orders_by_user), group_size=group_size)
+
+    # Assert
+    calls = counters.snapshot()['calls']
+    assert calls['get_orders_by_users'] == math.ceil(len(orders_by_user) / group_size)
+    assert 'get_orders_by_user' not in calls
+    assert calls['update_order_status'] <= MAX_STATUS_UPDATES_PER_ORDER * ORDERS
+
+
+@pytest.mark.parametrize('driver', ['work_stealing', 'prefetching'])
+def test_should_keep_io_budget_with_multi_user_drivers(tmp_path, driver: str) -> None:
+    # Arrange
+    orders_by_user = _orders_by_user(TYPE_MIXES['b_heavy'])
+    service, counters = _instrumented_service(tmp_path, orders_by_user)
+    if driver == 'work_stealing':
+        runner = WorkStealingScheduler(service, workers=4, chunk_size=16)
+    else:
+        runner = PrefetchingDriver(service, lookahead=2)
+
+    # Act
+    results = runner.run(list(orders_by_user))
+
+    # Assert
+    assert all(results.values())
+    _assert_within_budget(counters, len(orders_by_user), ORDERS, _type_counts(orders_by_user))
+
+
+def test_should_count_exports_once_per_wrapper_without_changing_wrapped_exporter(tmp_path) -> None:
+    # Arrange
+    exporter = OrderExporter(str(tmp_path))
+    first = CountingOrderExporter(exporter)
+    second = CountingOrderExporter(exporter)
+    order = Order(id=1, type='A', amount=100.0, flag=False)
+
+    # Act
+    first.export_order_to_csv(order, 1)
+    second.export_order_to_csv(order, 2)
+    exporter.export_order_to_csv(order, 3)
+
+    # Assert
+    assert exporter.opener is None
+    assert (first.counters.files_opened, second.counters.files_opened) == (1, 1)
+    assert first.counters.bytes_written == second.counters.bytes_written > 0
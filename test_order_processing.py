@@ -1,3 +1,14 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import Mock, patch
 import pytest
 from exam import (
@@ -7,7 +18,40 @@ from exam import (
     APIClient,
     APIResponse,
     APIException,
-    DatabaseException
+    DatabaseException,
+    RateLimitedAPIClient,
+    SingleFlightAPIClient,
+    QueueOrderSource,
+    FileTailOrderSource,
+    OrderStreamConsumer,
+    MicroBatcher,
+    BatchingDatabaseService,
+    BatchingAPIClient,
+    InMemoryDatabaseService,
+    SyntheticAPIClient,
+    OrderDatasetGenerator,
+    lognormal_amounts,
+    write_orders_file,
+    read_orders_file,
+    load_orders_file,
+    write_mapped_orders_file,
+    read_mapped_orders_file,
+    MmapDatabaseService,
+    RecordingAPIClient,
+    ReplayAPIClient,
+    OrderExporter,
+    ShardedOrderExporter,
+    APITimeoutException,
+    DatabaseTimeoutException,
+    TimeoutAPIClient,
+    TimeoutRunner,
+    WorkStealingScheduler,
+    AdaptiveAPIClient,
+    ScriptedLatencyAPIClient,
+    HedgingAPIClient,
+    PrefetchingDriver,
+    write_orders_csv,
+    main
 )
 
 
@@ -24,6 +68,39 @@ class MockAPIClient(APIClient):
         pass
 
 
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class BlockingAPIClient(APIClient):
+    def __init__(self, outcome) -> None:
+        self.outcome = outcome
+        self.release = threading.Event()
+        self.calls = 0
+
+    def call_api(self, order_id: int) -> APIResponse:
+        self.calls += 1
+        self.release.wait(timeout=5)
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.001)
+
+
 @pytest.fixture
 def mock_db_service() -> MockDatabaseService:
     return MockDatabaseService()
@@ -1027,3 +1104,1863 @@ def test_should_handle_type_b_with_api_success_and_data_ge_50_and_amount_lt_100_
     assert order.priority == 'low'
 
 
+def test_should_not_wait_when_calls_fit_in_rate_limiter_burst(
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    clock = FakeClock()
+    mock_api_client.call_api = Mock(return_value=APIResponse(status='success', data=60))
+    client = RateLimitedAPIClient(mock_api_client, rate=10, burst=3, clock=clock, sleep=clock.sleep)
+
+    # Act
+    for order_id in range(3):
+        client.call_api(order_id)
+
+    # Assert
+    assert clock.now == 0.0
+    assert client.metrics()['throttled_calls'] == 0
+    assert mock_api_client.call_api.call_count == 3
+
+
+def test_should_wait_for_next_token_when_rate_limiter_burst_is_exhausted(
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    clock = FakeClock()
+    mock_api_client.call_api = Mock(return_value=APIResponse(status='success', data=60))
+    client = RateLimitedAPIClient(mock_api_client, rate=10, burst=2, clock=clock, sleep=clock.sleep)
+
+    # Act
+    responses = [client.call_api(order_id) for order_id in range(4)]
+
+    # Assert
+    metrics = client.metrics()
+    assert all(response.status == 'success' for response in responses)
+    assert clock.now == pytest.approx(0.2)
+    assert metrics['throttled_calls'] == 2
+    assert metrics['max_wait'] == pytest.approx(0.1)
+    assert metrics['total_wait'] == pytest.approx(0.2)
+
+
+def test_should_propagate_api_exception_through_rate_limiter(
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    clock = FakeClock()
+    mock_api_client.call_api = Mock(side_effect=APIException())
+    client = RateLimitedAPIClient(mock_api_client, rate=10, clock=clock, sleep=clock.sleep)
+
+    # Act / Assert
+    with pytest.raises(APIException):
+        client.call_api(1)
+
+
+def test_should_rate_limit_async_calls(
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    mock_api_client.call_api = Mock(return_value=APIResponse(status='success', data=60))
+    client = RateLimitedAPIClient(mock_api_client, rate=100, burst=1)
+
+    async def run() -> list:
+        return await asyncio.gather(*(client.call_api_async(order_id) for order_id in range(3)))
+
+    # Act
+    responses = asyncio.run(run())
+
+    # Assert
+    assert len(responses) == 3
+    assert client.metrics()['throttled_calls'] == 2
+    assert mock_api_client.call_api.call_count == 3
+
+
+def test_should_reject_non_positive_rate_limiter_rate(
+    mock_api_client: MockAPIClient
+) -> None:
+    # Act / Assert
+    with pytest.raises(ValueError):
+        RateLimitedAPIClient(mock_api_client, rate=0)
+
+
+def test_should_share_one_in_flight_call_for_same_order_id() -> None:
+    # Arrange
+    response = APIResponse(status='success', data=60)
+    upstream = BlockingAPIClient(response)
+    client = SingleFlightAPIClient(upstream)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.call_api(7))) for _ in range(5)]
+
+    # Act
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: client.metrics()['coalesced_calls'] == 4)
+    upstream.release.set()
+    for thread in threads:
+        thread.join()
+
+    # Assert
+    assert upstream.calls == 1
+    assert results == [response] * 5
+    assert client.metrics() == {'calls': 5, 'coalesced_calls': 4, 'upstream_calls': 1, 'in_flight': 0}
+
+
+def test_should_share_api_exception_with_coalesced_callers() -> None:
+    # Arrange
+    upstream = BlockingAPIClient(APIException('boom'))
+    client = SingleFlightAPIClient(upstream)
+    errors = []
+
+    def call() -> None:
+        try:
+            client.call_api(7)
+        except APIException as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+
+    # Act
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: client.metrics()['coalesced_calls'] == 2)
+    upstream.release.set()
+    for thread in threads:
+        thread.join()
+
+    # Assert
+    assert upstream.calls == 1
+    assert len(errors) == 3
+    assert all(error is errors[0] for error in errors)
+
+
+def test_should_not_coalesce_sequential_calls_for_same_order_id(
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    mock_api_client.call_api = Mock(return_value=APIResponse(status='success', data=60))
+    client = SingleFlightAPIClient(mock_api_client)
+
+    # Act
+    client.call_api(7)
+    client.call_api(7)
+
+    # Assert
+    assert mock_api_client.call_api.call_count == 2
+    assert client.metrics()['coalesced_calls'] == 0
+
+
+def test_should_process_high_priority_orders_first_in_priority_scheduling_mode(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient,
+    mock_csv_writer,
+    mock_file_open
+) -> None:
+    # Arrange
+    orders = [
+        Order(id=1, type='C', amount=10.0, flag=True),
+        Order(id=2, type='C', amount=300.0, flag=True),
+        Order(id=3, type='A', amount=20.0, flag=False),
+        Order(id=4, type='C', amount=500.0, flag=False)
+    ]
+    processed_ids = []
+    mock_db_service.get_orders_by_user = Mock(return_value=orders)
+    mock_db_service.update_order_status = Mock(side_effect=lambda order_id, status, priority: processed_ids.append(order_id))
+    service = OrderProcessingService(mock_db_service, mock_api_client, scheduling='priority')
+
+    # Act
+    result = service.process_orders(user_id=1)
+
+    # Assert
+    assert result is True
+    assert processed_ids == [2, 4, 1, 3]
+
+
+def test_should_keep_fetch_order_in_default_fifo_scheduling_mode(
+    order_processing_service: OrderProcessingService,
+    mock_db_service: MockDatabaseService
+) -> None:
+    # Arrange
+    orders = [
+        Order(id=1, type='C', amount=10.0, flag=True),
+        Order(id=2, type='C', amount=300.0, flag=True)
+    ]
+    processed_ids = []
+    mock_db_service.get_orders_by_user = Mock(return_value=orders)
+    mock_db_service.update_order_status = Mock(side_effect=lambda order_id, status, priority: processed_ids.append(order_id))
+
+    # Act
+    order_processing_service.process_orders(user_id=1)
+
+    # Assert
+    assert processed_ids == [1, 2]
+
+
+def test_should_report_time_to_completion_per_priority_class(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    clock = FakeClock()
+    orders = [
+        Order(id=1, type='C', amount=10.0, flag=True),
+        Order(id=2, type='C', amount=300.0, flag=True),
+        Order(id=3, type='C', amount=400.0, flag=True)
+    ]
+    mock_db_service.get_orders_by_user = Mock(return_value=orders)
+    mock_db_service.update_order_status = Mock(side_effect=lambda *args: clock.sleep(1.0))
+    service = OrderProcessingService(mock_db_service, mock_api_client, scheduling='priority', clock=clock)
+
+    # Act
+    service.process_orders(user_id=1)
+
+    # Assert
+    report = service.last_report
+    assert report.success is True
+    assert report.processed_count == 3
+    assert report.completion_times == {'high': [1.0, 2.0], 'low': [3.0]}
+    assert report.completion_summary()['high'] == {'count': 2, 'mean': 1.5, 'max': 2.0}
+
+
+def test_should_reject_unknown_scheduling_mode(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Act / Assert
+    with pytest.raises(ValueError):
+        OrderProcessingService(mock_db_service, mock_api_client, scheduling='random')
+
+
+def test_should_process_queued_orders_in_micro_batches(
+    order_processing_service: OrderProcessingService,
+    mock_db_service: MockDatabaseService
+) -> None:
+    # Arrange
+    mock_db_service.update_order_status = Mock(return_value=True)
+    source = QueueOrderSource()
+    orders = [Order(id=order_id, type='C', amount=100.0, flag=True) for order_id in range(5)]
+    for order in orders:
+        source.put(1, order)
+    consumer = OrderStreamConsumer(order_processing_service, source, max_batch_size=2, max_batch_wait=0.01)
+
+    # Act
+    consumer.start()
+    wait_until(lambda: consumer.processed_count == 5)
+    consumer.stop(timeout=5)
+
+    # Assert
+    assert all(order.status == 'completed' for order in orders)
+    assert consumer.batch_count == 3
+    assert mock_db_service.update_order_status.call_count == 5
+
+
+def test_should_drain_pending_orders_on_stream_consumer_shutdown(
+    order_processing_service: OrderProcessingService,
+    mock_db_service: MockDatabaseService
+) -> None:
+    # Arrange
+    mock_db_service.update_order_status = Mock(return_value=True)
+    source = QueueOrderSource()
+    orders = [Order(id=order_id, type='C', amount=100.0, flag=False) for order_id in range(10)]
+    for order in orders:
+        source.put(1, order)
+    consumer = OrderStreamConsumer(order_processing_service, source, max_batch_size=3)
+
+    # Act
+    consumer.stop()
+    consumer.run()
+
+    # Assert
+    assert consumer.processed_count == 10
+    assert all(order.status == 'in_progress' for order in orders)
+
+
+def test_should_count_failed_orders_without_stopping_stream_consumer(
+    order_processing_service: OrderProcessingService,
+    mock_db_service: MockDatabaseService
+) -> None:
+    # Arrange
+    mock_db_service.update_order_status = Mock(side_effect=[ConnectionError(), True])
+    source = QueueOrderSource()
+    source.put(1, Order(id=1, type='C', amount=100.0, flag=True))
+    source.put(1, Order(id=2, type='C', amount=100.0, flag=True))
+    consumer = OrderStreamConsumer(order_processing_service, source)
+
+    # Act
+    consumer.stop()
+    consumer.run()
+
+    # Assert
+    assert consumer.failed_count == 1
+    assert consumer.processed_count == 1
+
+
+@pytest.mark.parametrize('max_batch_wait', [0, -0.01])
+def test_should_reject_non_positive_stream_consumer_batch_wait(
+    order_processing_service: OrderProcessingService,
+    max_batch_wait: float
+) -> None:
+    # Act / Assert
+    with pytest.raises(ValueError):
+        OrderStreamConsumer(order_processing_service, QueueOrderSource(), max_batch_wait=max_batch_wait)
+
+
+def test_should_tail_newline_delimited_order_file(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient,
+    tmp_path
+) -> None:
+    # Arrange
+    path = tmp_path / 'orders.ndjson'
+    records = [
+        {'user_id': 1, 'id': 1, 'type': 'C', 'amount': 100.0, 'flag': True},
+        {'user_id': 2, 'id': 2, 'type': 'C', 'amount': 300.0, 'flag': False}
+    ]
+    path.write_text(json.dumps(records[0]) + '\n')
+    updates = []
+    mock_db_service.update_order_status = Mock(side_effect=lambda *args: updates.append(args))
+    consumer = OrderStreamConsumer(
+        OrderProcessingService(mock_db_service, mock_api_client),
+        FileTailOrderSource(str(path), poll_interval=0.001),
+        max_batch_wait=0.01
+    )
+
+    # Act
+    consumer.start()
+    wait_until(lambda: len(updates) == 1)
+    with open(path, 'a') as file_handle:
+        line = json.dumps(records[1]) + '\n'
+        file_handle.write(line[:10])
+        file_handle.flush()
+        time.sleep(0.02)
+        file_handle.write(line[10:])
+    wait_until(lambda: len(updates) == 2)
+    consumer.stop(timeout=5)
+
+    # Assert
+    assert updates == [(1, 'completed', 'low'), (2, 'in_progress', 'high')]
+
+
+def test_should_flush_single_request_immediately_under_light_load() -> None:
+    # Arrange
+    batches = []
+    batcher = MicroBatcher(lambda items: batches.append(items) or [item * 2 for item in items], max_wait=10)
+
+    # Act
+    result = batcher.submit(21).result(timeout=1)
+    batcher.close()
+
+    # Assert
+    assert result == 42
+    assert batches == [[21]]
+
+
+def test_should_group_concurrent_requests_up_to_max_batch_size() -> None:
+    # Arrange
+    release = threading.Event()
+    batches = []
+
+    def flush(items: list) -> list:
+        release.wait(timeout=5)
+        batches.append(items)
+        return items
+
+    batcher = MicroBatcher(flush, max_batch_size=4, max_wait=0.05)
+    first = batcher.submit(0)
+    wait_until(lambda: not batcher._pending)
+
+    # Act
+    futures = [batcher.submit(item) for item in range(1, 10)]
+    release.set()
+    results = [future.result(timeout=5) for future in [first] + futures]
+    batcher.close()
+
+    # Assert
+    metrics = batcher.metrics()
+    assert results == list(range(10))
+    assert [len(batch) for batch in batches] == [1, 4, 4, 1]
+    assert metrics['batch_size']['count'] == 4
+    assert metrics['batch_size']['max'] == 4
+    assert metrics['wait_time']['count'] == 10
+
+
+def test_should_fail_every_request_in_batch_when_flush_raises() -> None:
+    # Arrange
+    batcher = MicroBatcher(Mock(side_effect=ConnectionError()))
+
+    # Act
+    future = batcher.submit(1)
+    batcher.close()
+
+    # Assert
+    with pytest.raises(ConnectionError):
+        future.result(timeout=1)
+
+
+@pytest.mark.parametrize('flush_result', [None, [True]])
+def test_should_fail_requests_and_keep_batcher_alive_when_flush_returns_wrong_result_count(flush_result) -> None:
+    # Arrange
+    release = threading.Event()
+    calls = []
+
+    def flush(items: list):
+        calls.append(items)
+        if len(calls) == 1:
+            release.wait(timeout=5)
+            return [item for item in items]
+        if len(calls) == 2:
+            return flush_result
+        return items
+
+    batcher = MicroBatcher(flush, max_wait=0.01)
+    first = batcher.submit(0)
+    wait_until(lambda: not batcher._pending)
+    broken = [batcher.submit(1), batcher.submit(2)]
+    release.set()
+
+    # Act
+    first.result(timeout=5)
+    errors = []
+    for future in broken:
+        with pytest.raises(ValueError) as excinfo:
+            future.result(timeout=5)
+        errors.append(excinfo.value)
+    later = batcher.submit(3).result(timeout=5)
+    batcher.close()
+
+    # Assert
+    assert len(errors) == 2
+    assert later == 3
+
+
+def test_should_set_db_error_only_for_failed_update_in_batch(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    orders = [
+        Order(id=1, type='C', amount=100.0, flag=True),
+        Order(id=2, type='C', amount=100.0, flag=True)
+    ]
+    mock_db_service.get_orders_by_user = Mock(return_value=orders)
+    mock_db_service.update_order_status = Mock(side_effect=[DatabaseException(), True])
+    batching_db = BatchingDatabaseService(mock_db_service)
+    service = OrderProcessingService(batching_db, mock_api_client)
+
+    # Act
+    result = service.process_orders(user_id=1)
+    batching_db.close()
+
+    # Assert
+    assert result is True
+    assert orders[0].status == 'db_error'
+    assert orders[1].status == 'completed'
+    assert batching_db.metrics()['batch_size']['count'] == 2
+
+
+def test_should_route_type_b_api_calls_through_batching_client(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    order = Order(id=1, type='B', amount=80.0, flag=False)
+    mock_db_service.get_orders_by_user = Mock(return_value=[order])
+    mock_db_service.update_order_status = Mock(return_value=True)
+    mock_api_client.call_api_batch = Mock(return_value=[APIResponse(status='success', data=60)])
+    batching_api = BatchingAPIClient(mock_api_client)
+    service = OrderProcessingService(mock_db_service, batching_api)
+
+    # Act
+    service.process_orders(user_id=1)
+    batching_api.close()
+
+    # Assert
+    assert order.status == 'processed'
+    mock_api_client.call_api_batch.assert_called_once_with([1])
+
+
+def test_should_return_same_synthetic_api_response_for_same_order_id() -> None:
+    # Arrange
+    client = SyntheticAPIClient(seed=3, success_ratio=1.0, failure_ratio=0.0)
+
+    # Act
+    first = client.call_api(42)
+    second = client.call_api(42)
+
+    # Assert
+    assert first.status == second.status == 'success'
+    assert first.data == second.data
+
+
+def test_should_record_status_updates_in_memory_database(
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    db_service = InMemoryDatabaseService()
+    db_service.add_order(1, Order(id=5, type='C', amount=300.0, flag=True))
+    service = OrderProcessingService(db_service, mock_api_client)
+
+    # Act
+    result = service.process_orders(user_id=1)
+
+    # Assert
+    assert result is True
+    assert db_service.updates == {5: ('completed', 'high')}
+    assert service.process_orders(user_id=2) is False
+
+
+def test_should_write_profile_report_and_pstats_file_from_profile_command(
+    tmp_path,
+    capsys
+) -> None:
+    # Arrange
+    pstats_path = tmp_path / 'run.pstats'
+
+    # Act
+    exit_code = main([
+        'profile', '--users', '2', '--orders-per-user', '20', '--top', '5',
+        '--pstats', str(pstats_path), '--export-dir', str(tmp_path)
+    ])
+
+    # Assert
+    output = capsys.readouterr().out
+    assert exit_code == 0
+    assert pstats_path.exists()
+    assert 'process_orders' in output
+    assert 'allocation sites' in output
+    assert list(tmp_path.glob('orders_type_A_*.csv'))
+
+
+def test_should_profile_orders_loaded_from_file(
+    tmp_path,
+    capsys
+) -> None:
+    # Arrange
+    orders_file = tmp_path / 'orders.ndjson'
+    orders_file.write_text(json.dumps({'user_id': 9, 'id': 1, 'type': 'C', 'amount': 10.0, 'flag': True}) + '\n')
+
+    # Act
+    exit_code = main(['profile', '--orders-file', str(orders_file), '--pstats', str(tmp_path / 'run.pstats')])
+
+    # Assert
+    assert exit_code == 0
+    assert '_process_order' in capsys.readouterr().out
+
+
+def test_should_generate_same_orders_for_same_seed() -> None:
+    # Arrange
+    first = OrderDatasetGenerator(seed=7, orders_per_user=3)
+    second = OrderDatasetGenerator(seed=7, orders_per_user=3)
+
+    # Act
+    first_orders = [(user_id, order.id, order.type, order.amount, order.flag) for user_id, order in first.iter_orders(10)]
+    second_orders = [(user_id, order.id, order.type, order.amount, order.flag) for user_id, order in second.iter_orders(10)]
+
+    # Assert
+    assert first_orders == second_orders
+    assert [user_id for user_id, *_ in first_orders] == [1, 1, 1, 2, 2, 2, 3, 3, 3, 4]
+
+
+def test_should_follow_configured_type_mix_and_flag_ratio() -> None:
+    # Arrange
+    generator = OrderDatasetGenerator(
+        seed=1,
+        type_mix={'A': 0.0, 'B': 3.0, 'C': 1.0},
+        amount_distribution=lognormal_amounts(),
+        flag_ratio=0.0
+    )
+
+    # Act
+    orders = [order for _, order in generator.iter_orders(4000)]
+
+    # Assert
+    type_b_share = sum(order.type == 'B' for order in orders) / len(orders)
+    assert not any(order.type == 'A' for order in orders)
+    assert 0.7 < type_b_share < 0.8
+    assert not any(order.flag for order in orders)
+    assert all(order.amount > 0 for order in orders)
+
+
+def test_should_stream_generated_orders_lazily() -> None:
+    # Arrange
+    generator = OrderDatasetGenerator(seed=1)
+
+    # Act
+    stream = generator.iter_orders(10 ** 12)
+    user_id, order = next(stream)
+
+    # Assert
+    assert (user_id, order.id) == (1, 1)
+
+
+def test_should_build_api_client_with_configured_response_distribution() -> None:
+    # Arrange
+    generator = OrderDatasetGenerator(seed=1, api_success_ratio=0.0, api_failure_ratio=1.0)
+
+    # Act / Assert
+    with pytest.raises(APIException):
+        generator.api_client().call_api(1)
+
+
+def test_should_round_trip_orders_through_binary_orders_file(tmp_path) -> None:
+    # Arrange
+    path = str(tmp_path / 'orders.bin')
+    records = list(OrderDatasetGenerator(seed=2, orders_per_user=5).iter_orders(25))
+
+    # Act
+    count = write_orders_file(path, records)
+    loaded = list(read_orders_file(path))
+
+    # Assert
+    assert count == 25
+    assert [(user_id, order.id, order.type, order.amount, order.flag) for user_id, order in loaded] == \
+        [(user_id, order.id, order.type, order.amount, order.flag) for user_id, order in records]
+    assert sorted(load_orders_file(path)) == [1, 2, 3, 4, 5]
+
+
+def test_should_reject_order_type_that_does_not_fit_orders_file(tmp_path) -> None:
+    # Act / Assert
+    with pytest.raises(ValueError):
+        write_orders_file(str(tmp_path / 'orders.bin'), [(1, Order(id=1, type='AB', amount=1.0, flag=False))])
+
+
+def test_should_write_orders_file_from_generate_command(tmp_path, capsys) -> None:
+    # Arrange
+    path = tmp_path / 'orders.bin'
+
+    # Act
+    exit_code = main(['generate', str(path), '--count', '50', '--type-mix', 'C=1'])
+
+    # Assert
+    assert exit_code == 0
+    assert 'wrote 50 orders' in capsys.readouterr().out
+    assert {order.type for _, order in read_orders_file(str(path))} == {'C'}
+
+
+@pytest.fixture
+def mapped_orders_path(tmp_path) -> str:
+    path = str(tmp_path / 'orders.map')
+    write_mapped_orders_file(path, [
+        (1, Order(id=1, type='C', amount=100.0, flag=True)),
+        (1, Order(id=2, type='C', amount=300.0, flag=False)),
+        (2, Order(id=3, type='B', amount=80.0, flag=False))
+    ])
+    return path
+
+
+def test_should_slice_user_orders_from_mapped_orders_file(mapped_orders_path: str) -> None:
+    # Arrange
+    with MmapDatabaseService(mapped_orders_path) as db_service:
+        # Act
+        orders = db_service.get_orders_by_user(1)
+
+        # Assert
+        assert len(orders) == 2
+        assert [(order.id, order.type, order.amount, order.flag) for order in orders] == [
+            (1, 'C', 100.0, True),
+            (2, 'C', 300.0, False)
+        ]
+        assert orders[-1].status == 'new'
+        assert len(db_service.get_orders_by_user(99)) == 0
+
+
+def test_should_write_status_updates_in_place_to_mapped_orders_file(
+    mapped_orders_path: str,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    with MmapDatabaseService(mapped_orders_path) as db_service:
+        service = OrderProcessingService(db_service, mock_api_client)
+
+        # Act
+        result = service.process_orders(user_id=1)
+        db_service.flush()
+
+    # Assert
+    with MmapDatabaseService(mapped_orders_path) as db_service:
+        orders = db_service.get_orders_by_user(1)
+        assert result is True
+        assert [(order.status, order.priority) for order in orders] == [('completed', 'low'), ('in_progress', 'high')]
+        assert db_service.get_orders_by_user(2)[0].status == 'new'
+
+
+def test_should_return_false_for_user_without_orders_in_mapped_orders_file(
+    mapped_orders_path: str,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    with MmapDatabaseService(mapped_orders_path) as db_service:
+        service = OrderProcessingService(db_service, mock_api_client)
+
+        # Act
+        result = service.process_orders(user_id=42)
+
+    # Assert
+    assert result is False
+
+
+def test_should_update_orders_of_any_user_in_mapped_orders_file(tmp_path) -> None:
+    # Arrange
+    path = str(tmp_path / 'orders.map')
+    write_mapped_orders_file(path, [
+        (user_id, Order(id=1000 - user_id, type='C', amount=1.0, flag=True)) for user_id in range(1, 201)
+    ] + [(201, Order(id=5, type='C', amount=1.0, flag=True)), (201, Order(id=5, type='C', amount=1.0, flag=True))])
+
+    with MmapDatabaseService(path) as db_service:
+        # Act
+        results = [db_service.update_order_status(1000 - user_id, 'completed', 'low') for user_id in range(1, 201)]
+        db_service.update_order_status(5, 'in_progress', 'high')
+
+        # Assert
+        assert all(results)
+        assert all(db_service.get_orders_by_user(user_id)[0].status == 'completed' for user_id in range(1, 201))
+        assert [order.status for order in db_service.get_orders_by_user(201)] == ['in_progress', 'in_progress']
+        with pytest.raises(DatabaseException):
+            db_service.update_order_status(12345, 'completed', 'low')
+
+
+def test_should_reject_mapped_orders_file_with_non_contiguous_users(tmp_path) -> None:
+    # Act / Assert
+    with pytest.raises(ValueError):
+        write_mapped_orders_file(str(tmp_path / 'orders.map'), [
+            (1, Order(id=1, type='C', amount=1.0, flag=True)),
+            (2, Order(id=2, type='C', amount=1.0, flag=True)),
+            (1, Order(id=3, type='C', amount=1.0, flag=True))
+        ])
+
+
+def test_should_generate_mapped_orders_file_from_generate_command(tmp_path, capsys) -> None:
+    # Arrange
+    path = str(tmp_path / 'orders.map')
+
+    # Act
+    main(['generate', path, '--count', '30', '--orders-per-user', '10', '--format', 'mapped'])
+
+    # Assert
+    with MmapDatabaseService(path) as db_service:
+        assert db_service.record_count == 30
+        assert [order.id for order in db_service.get_orders_by_user(2)] == list(range(11, 21))
+
+
+def test_should_profile_mapped_orders_file_from_generate_command(tmp_path, capsys) -> None:
+    # Arrange
+    path = str(tmp_path / 'orders.map')
+    main(['generate', path, '--count', '30', '--orders-per-user', '10', '--format', 'mapped'])
+
+    # Act
+    exit_code = main(['profile', '--orders-file', path, '--pstats', str(tmp_path / 'run.pstats')])
+
+    # Assert
+    assert exit_code == 0
+    assert '_process_order' in capsys.readouterr().out
+    assert {user_id: len(orders) for user_id, orders in load_orders_file(path).items()} == {1: 10, 2: 10, 3: 10}
+
+
+@pytest.mark.parametrize('sort_run_records', [1, 3, 1000])
+def test_should_index_unsorted_order_ids_with_bounded_sort_runs(tmp_path, sort_run_records: int) -> None:
+    # Arrange
+    path = str(tmp_path / 'orders.map')
+    order_ids = [(order_id * 7919) % 101 for order_id in range(40)] + [3, 3]
+
+    # Act
+    write_mapped_orders_file(path, [
+        (position // 5, Order(id=order_id, type='C', amount=1.0, flag=True)) for position, order_id in enumerate(order_ids)
+    ], sort_run_records=sort_run_records)
+
+    # Assert
+    with MmapDatabaseService(path) as db_service:
+        assert [db_service._record_positions(order_id) for order_id in order_ids[:40]] == [
+            [position] if order_id != 3 else [position, 40, 41] for position, order_id in enumerate(order_ids[:40])
+        ]
+    assert [order.id for _, order in read_mapped_orders_file(path)] == order_ids
+
+
+def test_should_replay_recorded_responses_and_exceptions(
+    mock_api_client: MockAPIClient,
+    tmp_path
+) -> None:
+    # Arrange
+    path = str(tmp_path / 'api.rec')
+    mock_api_client.call_api = Mock(side_effect=[
+        APIResponse(status='success', data=60),
+        APIException('quota exceeded'),
+        APIResponse(status='error', data=None)
+    ])
+    recorder = RecordingAPIClient(mock_api_client, path)
+    recorder.call_api(1)
+    with pytest.raises(APIException):
+        recorder.call_api(2)
+    recorder.call_api(1)
+    recorder.close()
+
+    # Act
+    replay = ReplayAPIClient(path)
+    first = replay.call_api(1)
+    second = replay.call_api(1)
+    third = replay.call_api(1)
+
+    # Assert
+    assert (first.status, first.data) == ('success', 60)
+    assert (second.status, second.data) == ('error', None)
+    assert (third.status, third.data) == ('error', None)
+    with pytest.raises(APIException, match='quota exceeded'):
+        replay.call_api(2)
+    with pytest.raises(APIException):
+        replay.call_api(3)
+
+
+def test_should_reinject_recorded_latency_when_requested(
+    mock_api_client: MockAPIClient,
+    tmp_path
+) -> None:
+    # Arrange
+    path = str(tmp_path / 'api.rec')
+    clock = FakeClock()
+    mock_api_client.call_api = Mock(side_effect=lambda order_id: clock.sleep(0.25) or APIResponse(status='success', data=60))
+    recorder = RecordingAPIClient(mock_api_client, path, clock=clock)
+    recorder.call_api(1)
+    recorder.close()
+    replay_clock = FakeClock()
+
+    # Act
+    ReplayAPIClient(path, replay_latency=True, sleep=replay_clock.sleep).call_api(1)
+    ReplayAPIClient(path, sleep=replay_clock.sleep).call_api(1)
+
+    # Assert
+    assert replay_clock.now == pytest.approx(0.25)
+
+
+def test_should_reproduce_type_b_outcomes_from_recording(
+    mock_api_client: MockAPIClient,
+    tmp_path
+) -> None:
+    # Arrange
+    path = str(tmp_path / 'api.rec')
+    orders = {1: [Order(id=1, type='B', amount=80.0, flag=False), Order(id=2, type='B', amount=80.0, flag=False)]}
+    mock_api_client.call_api = Mock(side_effect=[APIResponse(status='success', data=60), APIException()])
+    recorder = RecordingAPIClient(mock_api_client, path)
+    OrderProcessingService(InMemoryDatabaseService(orders), recorder).process_orders(user_id=1)
+    recorder.close()
+    replay_orders = {1: [Order(id=1, type='B', amount=80.0, flag=False), Order(id=2, type='B', amount=80.0, flag=False)]}
+
+    # Act
+    OrderProcessingService(InMemoryDatabaseService(replay_orders), ReplayAPIClient(path)).process_orders(user_id=1)
+
+    # Assert
+    assert [order.status for order in replay_orders[1]] == ['processed', 'api_failure']
+
+
+def test_should_not_import_optional_subsystems_when_importing_and_constructing_service() -> None:
+    # Arrange
+    lazy_modules = ('argparse', 'asyncio', 'concurrent.futures', 'cProfile', 'csv', 'json', 'mmap', 'pstats', 'queue', 'random', 'tempfile', 'tracemalloc')
+    code = (
+        'import sys, exam\n'
+        'exam.OrderProcessingService(exam.InMemoryDatabaseService(), exam.SyntheticAPIClient())\n'
+        f'print(",".join(m for m in {lazy_modules!r} if m in sys.modules))'
+    )
+
+    # Act
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+
+    # Assert
+    assert result.stdout.strip() == ''
+
+
+def test_should_construct_service_cheaply() -> None:
+    # Arrange
+    # Construction takes a few microseconds. The bound is about 30x that so it
+    # holds on slow CI machines; it catches order-of-magnitude regressions such
+    # as I/O in __init__, while lazy imports are covered by the test above.
+    max_construction_seconds = 100e-6
+    number = 1000
+
+    # Act
+    best = min(timeit.repeat(
+        lambda: OrderProcessingService(InMemoryDatabaseService(), SyntheticAPIClient()),
+        number=number,
+        repeat=5
+    ))
+
+    # Assert
+    assert best / number < max_construction_seconds
+
+
+def test_should_only_build_handlers_needed_by_processed_orders(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    mock_db_service.get_orders_by_user = Mock(return_value=[Order(id=1, type='C', amount=100.0, flag=True)])
+    mock_db_service.update_order_status = Mock(return_value=True)
+    service = OrderProcessingService(mock_db_service, mock_api_client)
+
+    # Act
+    service.process_orders(user_id=1)
+
+    # Assert
+    assert service._type_c_handler is not None
+    assert service._type_a_handler is None
+    assert service._type_b_handler is None
+    assert service._order_exporter is None
+
+
+def test_should_not_lose_exports_or_mix_statuses_when_processing_users_concurrently(tmp_path) -> None:
+    # Arrange
+    users = 2000
+    orders_by_user = {}
+    for user_id in range(1, users + 1):
+        base_id = user_id * 10
+        orders_by_user[user_id] = [
+            Order(id=base_id + 1, type='A', amount=100.0, flag=False),
+            Order(id=base_id + 2, type='A', amount=300.0, flag=True),
+            Order(id=base_id + 3, type='B', amount=80.0, flag=False),
+            Order(id=base_id + 4, type='C', amount=100.0, flag=user_id % 2 == 0)
+        ]
+    db_service = InMemoryDatabaseService(orders_by_user)
+    api_client = SyntheticAPIClient(seed=1)
+    service = OrderProcessingService(db_service, api_client, OrderExporter(str(tmp_path)))
+
+    def run(user_id: int) -> bool:
+        result = service.process_orders(user_id)
+        return result and service.last_report.user_id == user_id
+
+    # Act
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        results = list(executor.map(run, range(1, users + 1)))
+
+    # Assert
+    assert all(results)
+    exported_ids = set()
+    for path in tmp_path.glob('orders_type_A_*.csv'):
+        exported_ids.add(int(path.read_text().splitlines()[1].split(',')[0]))
+    assert exported_ids == {user_id * 10 + offset for user_id in range(1, users + 1) for offset in (1, 2)}
+    for user_id in range(1, users + 1):
+        base_id = user_id * 10
+        expected_b = service.type_b_handler.handle(Order(id=base_id + 3, type='B', amount=80.0, flag=False))
+        assert db_service.updates[base_id + 1] == ('exported', 'low')
+        assert db_service.updates[base_id + 2] == ('exported', 'high')
+        assert db_service.updates[base_id + 3] == (expected_b, 'low')
+        assert db_service.updates[base_id + 4] == ('completed' if user_id % 2 == 0 else 'in_progress', 'low')
+
+
+def test_should_give_each_export_of_same_user_its_own_file(tmp_path) -> None:
+    # Arrange
+    exporter = OrderExporter(str(tmp_path))
+    order = Order(id=1, type='A', amount=100.0, flag=False)
+
+    # Act
+    results = [exporter.export_order_to_csv(order, user_id=1) for _ in range(5)]
+
+    # Assert
+    assert results == ['exported'] * 5
+    assert len(list(tmp_path.glob('orders_type_A_1_*.csv'))) == 5
+
+
+def test_should_write_sharded_exports_and_find_them_through_manifest(tmp_path) -> None:
+    # Arrange
+    exporter = ShardedOrderExporter(str(tmp_path), shards=16, clock=lambda: 86400.0)
+    low = Order(id=1, type='A', amount=100.0, flag=False)
+    high = Order(id=2, type='A', amount=300.0, flag=True)
+
+    # Act
+    results = [exporter.export_order_to_csv(low, user_id=7), exporter.export_order_to_csv(high, user_id=7)]
+    exporter.export_order_to_csv(low, user_id=8)
+    exporter.close()
+
+    # Assert
+    assert results == ['exported', 'exported']
+    assert list(tmp_path.glob('*.csv')) == []
+    paths = exporter.find_exports(7)
+    assert len(paths) == 2
+    for path in paths:
+        assert os.path.dirname(path) == os.path.join(str(tmp_path), exporter.shard_for_user(7), '1970-01-02')
+        assert os.path.exists(path)
+    entries = [json.loads(line) for line in (tmp_path / 'manifest.ndjson').read_text().splitlines()]
+    assert [(entry['user_id'], entry['order_ids'], entry['rows']) for entry in entries] == [
+        (7, [1], 1), (7, [2], 2), (8, [1], 1)
+    ]
+
+
+def test_should_pick_up_manifest_entries_appended_after_a_lookup(tmp_path) -> None:
+    # Arrange
+    exporter = ShardedOrderExporter(str(tmp_path))
+    order = Order(id=1, type='A', amount=100.0, flag=False)
+    exporter.export_order_to_csv(order, user_id=3)
+    assert len(exporter.find_exports(3)) == 1
+
+    # Act
+    exporter.export_order_to_csv(order, user_id=3)
+
+    # Assert
+    assert len(exporter.find_exports(3)) == 2
+    assert exporter.find_exports(4) == []
+
+
+def test_should_track_last_report_per_thread(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    mock_db_service.get_orders_by_user = Mock(return_value=[])
+    service = OrderProcessingService(mock_db_service, mock_api_client)
+    service.process_orders(user_id=1)
+
+    # Act
+    thread = threading.Thread(target=service.process_orders, args=(2,))
+    thread.start()
+    thread.join()
+
+    # Assert
+    assert service.last_report.user_id == 1
+
+
+def test_should_summarise_decisions_without_side_effects_in_dry_run(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient,
+    mock_file_open
+) -> None:
+    # Arrange
+    mock_db_service.update_order_status = Mock()
+    mock_api_client.call_api = Mock()
+    service = OrderProcessingService(mock_db_service, mock_api_client)
+    orders = [
+        Order(id=1, type='A', amount=250.0, flag=False),
+        Order(id=2, type='B', amount=80.0, flag=False),
+        Order(id=3, type='B', amount=80.0, flag=False),
+        Order(id=4, type='B', amount=80.0, flag=False),
+        Order(id=5, type='C', amount=100.0, flag=True),
+        Order(id=6, type='X', amount=100.0, flag=True)
+    ]
+    api_data = {2: APIResponse(status='success', data=60), 3: APIException()}
+
+    # Act
+    summary = service.dry_run(orders, api_data)
+
+    # Assert
+    assert summary.decisions == [
+        (1, 'exported', 'high'),
+        (2, 'processed', 'low'),
+        (3, 'api_failure', 'low'),
+        (4, 'api_data_missing', 'low'),
+        (5, 'completed', 'low'),
+        (6, 'unknown_type', 'low')
+    ]
+    assert summary.priority_counts == {'high': 1, 'low': 5}
+    assert all(order.status == 'new' for order in orders)
+    mock_db_service.update_order_status.assert_not_called()
+    mock_api_client.call_api.assert_not_called()
+    mock_file_open.assert_not_called()
+
+
+def test_should_use_recorded_api_responses_in_dry_run(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient,
+    tmp_path
+) -> None:
+    # Arrange
+    path = str(tmp_path / 'api.rec')
+    upstream = Mock(spec=APIClient)
+    upstream.call_api = Mock(side_effect=[APIResponse(status='success', data=10), APIResponse(status='success', data=None)])
+    recorder = RecordingAPIClient(upstream, path)
+    recorder.call_api(1)
+    recorder.call_api(2)
+    recorder.close()
+    service = OrderProcessingService(mock_db_service, mock_api_client)
+
+    # Act
+    summary = service.dry_run(
+        [Order(id=1, type='B', amount=80.0, flag=False), Order(id=2, type='B', amount=80.0, flag=False)],
+        ReplayAPIClient(path)
+    )
+
+    # Assert
+    assert summary.status_counts == {'pending': 1, 'invalid_api_data': 1}
+
+
+def test_should_process_repeated_order_once_and_apply_result_to_every_copy(
+    order_processing_service: OrderProcessingService,
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient,
+    mock_file_open
+) -> None:
+    # Arrange
+    orders = [
+        Order(id=1, type='A', amount=300.0, flag=False),
+        Order(id=2, type='B', amount=80.0, flag=False),
+        Order(id=1, type='A', amount=300.0, flag=False),
+        Order(id=2, type='B', amount=80.0, flag=False),
+        Order(id=2, type='B', amount=80.0, flag=False)
+    ]
+    mock_db_service.get_orders_by_user = Mock(return_value=orders)
+    mock_db_service.update_order_status = Mock(return_value=True)
+    mock_api_client.call_api = Mock(return_value=APIResponse(status='success', data=60))
+
+    # Act
+    result = order_processing_service.process_orders(user_id=1)
+
+    # Assert
+    assert result is True
+    assert [order.status for order in orders] == ['exported', 'processed', 'exported', 'processed', 'processed']
+    assert [order.priority for order in orders] == ['high', 'low', 'high', 'low', 'low']
+    assert mock_file_open.call_count == 1
+    assert mock_api_client.call_api.call_count == 1
+    assert mock_db_service.update_order_status.call_count == 2
+    assert order_processing_service.last_report.duplicate_count == 3
+    assert order_processing_service.last_report.processed_count == 2
+
+
+def test_should_copy_db_error_status_to_duplicate_orders(
+    order_processing_service: OrderProcessingService,
+    mock_db_service: MockDatabaseService
+) -> None:
+    # Arrange
+    orders = [Order(id=1, type='C', amount=100.0, flag=True), Order(id=1, type='C', amount=100.0, flag=True)]
+    mock_db_service.get_orders_by_user = Mock(return_value=orders)
+    mock_db_service.update_order_status = Mock(side_effect=DatabaseException())
+
+    # Act
+    order_processing_service.process_orders(user_id=1)
+
+    # Assert
+    assert [order.status for order in orders] == ['db_error', 'db_error']
+    assert mock_db_service.update_order_status.call_count == 1
+
+
+def test_should_mark_remaining_orders_when_run_deadline_is_reached(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    clock = FakeClock()
+    orders = [
+        Order(id=1, type='B', amount=80.0, flag=False),
+        Order(id=2, type='C', amount=100.0, flag=True),
+        Order(id=3, type='C', amount=100.0, flag=True),
+        Order(id=4, type='B', amount=80.0, flag=False)
+    ]
+    mock_db_service.get_orders_by_user = Mock(return_value=orders)
+    mock_db_service.update_order_status = Mock(side_effect=lambda *args: clock.sleep(1.0))
+    mock_api_client.call_api = Mock(return_value=APIResponse(status='success', data=60))
+    service = OrderProcessingService(mock_db_service, mock_api_client, clock=clock, deadline=2.0)
+
+    # Act
+    result = service.process_orders(user_id=1)
+    service.close()
+
+    # Assert
+    report = service.last_report
+    assert result is False
+    assert [order.status for order in orders] == ['processed', 'completed', 'deadline_exceeded', 'deadline_exceeded']
+    assert report.deadline_exceeded is True
+    assert report.unprocessed_order_ids == [3, 4]
+    assert report.processed_count == 2
+    assert mock_api_client.call_api.call_count == 1
+    assert mock_db_service.update_order_status.call_count == 2
+
+
+@pytest.mark.parametrize('entry_point', ['process_orders', 'work_stealing'])
+def test_should_copy_outcome_to_duplicates_after_deadline_on_every_entry_point(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient,
+    entry_point: str
+) -> None:
+    # Arrange
+    clock = FakeClock()
+    orders = [Order(id=1, type='C', amount=100.0, flag=True), Order(id=1, type='C', amount=100.0, flag=True)]
+    mock_db_service.get_orders_by_user = Mock(return_value=orders)
+    mock_db_service.update_order_status = Mock(side_effect=lambda *args: clock.sleep(5.0))
+    service = OrderProcessingService(mock_db_service, mock_api_client, clock=clock, deadline=2.0)
+
+    # Act
+    if entry_point == 'process_orders':
+        result = service.process_orders(user_id=1)
+        report = service.last_report
+    else:
+        scheduler = WorkStealingScheduler(service, workers=1)
+        result = scheduler.run([1])[1]
+        report = scheduler.reports[1]
+    service.close()
+
+    # Assert
+    assert result is True
+    assert [order.status for order in orders] == ['completed', 'completed']
+    assert report.deadline_exceeded is False
+    assert report.unprocessed_order_ids == []
+    assert report.duplicate_count == 1
+    assert mock_db_service.update_order_status.call_count == 1
+
+
+@pytest.mark.parametrize('entry_point', ['process_orders', 'work_stealing'])
+def test_should_not_write_order_whose_deadline_passes_while_it_is_decided(
+    mock_db_service: MockDatabaseService,
+    entry_point: str
+) -> None:
+    # Arrange
+    clock = FakeClock()
+    orders = [Order(id=1, type='C', amount=100.0, flag=True), Order(id=5, type='B', amount=80.0, flag=False)]
+    mock_db_service.get_orders_by_user = Mock(return_value=orders)
+    mock_db_service.update_order_status = Mock(return_value=True)
+
+    class SlowAPIClient(APIClient):
+        def call_api(self, order_id: int) -> APIResponse:
+            clock.sleep(5.0)
+            return APIResponse(status='success', data=60)
+
+    service = OrderProcessingService(mock_db_service, SlowAPIClient(), clock=clock, deadline=2.0)
+
+    # Act
+    if entry_point == 'process_orders':
+        result = service.process_orders(user_id=1)
+        report = service.last_report
+    else:
+        scheduler = WorkStealingScheduler(service, workers=1)
+        result = scheduler.run([1])[1]
+        report = scheduler.reports[1]
+    service.close()
+
+    # Assert
+    assert result is False
+    assert [order.status for order in orders] == ['completed', 'deadline_exceeded']
+    assert report.unprocessed_order_ids == [5]
+    mock_db_service.update_order_status.assert_called_once_with(1, 'completed', 'low')
+
+
+def test_should_set_db_error_when_status_update_exceeds_timeout(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    release = threading.Event()
+    order = Order(id=1, type='C', amount=100.0, flag=True)
+    mock_db_service.get_orders_by_user = Mock(return_value=[order])
+    mock_db_service.update_order_status = Mock(side_effect=lambda *args: release.wait(5))
+    service = OrderProcessingService(mock_db_service, mock_api_client, db_timeout=0.01)
+
+    # Act
+    result = service.process_orders(user_id=1)
+    release.set()
+    service.close()
+
+    # Assert
+    assert result is True
+    assert order.status == 'db_error'
+
+
+def test_should_keep_serving_healthy_calls_after_timed_out_calls_hang(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    release = threading.Event()
+    orders = [Order(id=order_id, type='C', amount=100.0, flag=True) for order_id in range(1, 13)]
+    mock_db_service.get_orders_by_user = Mock(return_value=orders)
+    mock_db_service.update_order_status = Mock(side_effect=lambda order_id, *args: release.wait(5) if order_id <= 2 else True)
+    service = OrderProcessingService(mock_db_service, mock_api_client, db_timeout=0.05, timeout_workers=2)
+
+    # Act
+    service.process_orders(user_id=1)
+    abandoned = service._timeout_runner.abandoned_calls
+    release.set()
+    service.close()
+
+    # Assert
+    assert abandoned == 2
+    assert [order.status for order in orders] == ['db_error'] * 2 + ['completed'] * 10
+
+
+def test_should_fail_fast_when_too_many_timed_out_calls_are_still_running() -> None:
+    # Arrange
+    release = threading.Event()
+    runner = TimeoutRunner(max_workers=1, max_abandoned=1)
+    with pytest.raises(DatabaseTimeoutException):
+        runner.run(0.01, DatabaseTimeoutException, release.wait, 5)
+    started = time.monotonic()
+
+    # Act
+    with pytest.raises(DatabaseTimeoutException, match='still running'):
+        runner.run(5, DatabaseTimeoutException, lambda: True)
+
+    # Assert
+    assert time.monotonic() - started < 1
+    release.set()
+    wait_until(lambda: runner.abandoned_calls == 0)
+    assert runner.run(5, DatabaseTimeoutException, lambda: True) is True
+    runner.close()
+
+
+def test_should_set_api_failure_when_call_api_exceeds_timeout(
+    mock_db_service: MockDatabaseService
+) -> None:
+    # Arrange
+    upstream = BlockingAPIClient(APIResponse(status='success', data=60))
+    order = Order(id=1, type='B', amount=80.0, flag=False)
+    mock_db_service.get_orders_by_user = Mock(return_value=[order])
+    mock_db_service.update_order_status = Mock(return_value=True)
+    service = OrderProcessingService(mock_db_service, upstream, api_timeout=0.01)
+
+    # Act
+    result = service.process_orders(user_id=1)
+    upstream.release.set()
+    service.close()
+
+    # Assert
+    assert result is True
+    assert order.status == 'api_failure'
+
+
+def test_should_cap_api_timeout_by_remaining_budget() -> None:
+    # Arrange
+    upstream = BlockingAPIClient(APIResponse(status='success', data=60))
+    client = TimeoutAPIClient(upstream, timeout=10.0, budget=lambda: 0.01)
+    started = time.monotonic()
+
+    # Act
+    with pytest.raises(APITimeoutException):
+        client.call_api(1)
+    upstream.release.set()
+    client.close()
+
+    # Assert
+    assert time.monotonic() - started < 5
+
+
+def test_should_call_api_directly_without_timeouts(
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    mock_api_client.call_api = Mock(return_value=APIResponse(status='success', data=60))
+    client = TimeoutAPIClient(mock_api_client, timeout=None)
+
+    # Act
+    response = client.call_api(1)
+
+    # Assert
+    assert response.status == 'success'
+    assert client._runner is None
+
+
+def test_should_skip_malformed_records_in_tailed_order_file(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient,
+    tmp_path
+) -> None:
+    # Arrange
+    path = tmp_path / 'orders.ndjson'
+    valid = {'user_id': 1, 'id': 1, 'type': 'C', 'amount': 100.0, 'flag': True}
+    path.write_text('not json\n' + json.dumps({'user_id': 1, 'id': 2}) + '\n' + json.dumps(valid) + '\n')
+    mock_db_service.update_order_status = Mock(return_value=True)
+    source = FileTailOrderSource(str(path))
+    consumer = OrderStreamConsumer(OrderProcessingService(mock_db_service, mock_api_client), source)
+
+    # Act
+    consumer.stop()
+    consumer.run()
+
+    # Assert
+    assert consumer.processed_count == 1
+    assert consumer.failed_count == 2
+    assert source._file.closed
+    mock_db_service.update_order_status.assert_called_once_with(1, 'completed', 'low')
+
+
+def test_should_close_source_when_stream_consumer_fails(
+    order_processing_service: OrderProcessingService
+) -> None:
+    # Arrange
+    source = Mock(spec=QueueOrderSource)
+    source.poll = Mock(side_effect=OSError('disk gone'))
+    consumer = OrderStreamConsumer(order_processing_service, source)
+
+    # Act
+    with pytest.raises(OSError):
+        consumer.run()
+
+    # Assert
+    source.close.assert_called_once()
+
+
+def _users_of_mixed_sizes() -> dict:
+    orders_by_user = OrderDatasetGenerator(seed=3, orders_per_user=5).orders_by_user(200)
+    whale = OrderDatasetGenerator(seed=4, orders_per_user=1000).orders_by_user(1000)[1]
+    orders_by_user[100] = [Order(order.id + 10000, order.type, order.amount, order.flag) for order in whale]
+    # The same records again, landing in other chunks than their originals.
+    orders_by_user[100] += [Order(order.id, order.type, order.amount, order.flag) for order in orders_by_user[100][:30]]
+    orders_by_user[101] = []
+    return orders_by_user
+
+
+def test_should_match_process_orders_results_when_stealing_chunks_of_large_users(tmp_path) -> None:
+    # Arrange
+    user_ids = list(range(1, 41)) + [100, 101, 102]
+    sequential_db = InMemoryDatabaseService(_users_of_mixed_sizes())
+    sequential = OrderProcessingService(sequential_db, SyntheticAPIClient(seed=1), OrderExporter(str(tmp_path)), scheduling='priority')
+    expected = {}
+    expected_duplicates = {}
+    for user_id in user_ids:
+        expected[user_id] = sequential.process_orders(user_id)
+        expected_duplicates[user_id] = sequential.last_report.duplicate_count
+    stealing_db = InMemoryDatabaseService(_users_of_mixed_sizes())
+    service = OrderProcessingService(stealing_db, SyntheticAPIClient(seed=1), OrderExporter(str(tmp_path)), scheduling='priority')
+    scheduler = WorkStealingScheduler(service, workers=4, chunk_size=64)
+
+    # Act
+    results = scheduler.run(user_ids)
+
+    # Assert
+    assert results == expected
+    assert results[100] and not results[101] and not results[102]
+    assert stealing_db.updates == sequential_db.updates
+    assert scheduler.reports[100].processed_count == 1000
+    assert scheduler.reports[100].duplicate_count == expected_duplicates[100] == 30
+    assert set(scheduler.completion_times) == set(user_ids)
+    assert scheduler.completion_percentile(0.99) <= scheduler.makespan
+
+
+def test_should_spread_one_large_user_over_idle_workers() -> None:
+    # Arrange
+    threads_used = set()
+
+    class SlowDatabaseService(InMemoryDatabaseService):
+        def update_order_status(self, order_id: int, status: str, priority: str) -> bool:
+            threads_used.add(threading.current_thread().name)
+            time.sleep(0.001)
+            return super().update_order_status(order_id, status, priority)
+
+    orders = [Order(id=order_id, type='C', amount=100.0, flag=True) for order_id in range(1, 201)]
+    service = OrderProcessingService(SlowDatabaseService({1: orders}), MockAPIClient())
+    scheduler = WorkStealingScheduler(service, workers=4, chunk_size=10)
+
+    # Act
+    results = scheduler.run([1])
+
+    # Assert
+    assert results == {1: True}
+    assert len(threads_used) > 1
+    assert scheduler.steal_count > 0
+    assert all(order.status == 'completed' for order in orders)
+
+
+def test_should_report_user_completion_once_after_its_last_chunk() -> None:
+    # Arrange
+    orders = [Order(id=order_id, type='C', amount=100.0, flag=True) for order_id in range(1, 101)]
+    service = OrderProcessingService(InMemoryDatabaseService({1: orders, 2: []}), MockAPIClient())
+    completed = []
+    scheduler = WorkStealingScheduler(
+        service,
+        workers=3,
+        chunk_size=7,
+        on_user_complete=lambda user_id, result, report: completed.append((user_id, result, report.processed_count))
+    )
+
+    # Act
+    scheduler.run([1, 2])
+
+    # Assert
+    assert sorted(completed) == [(1, True, 100), (2, False, 0)]
+
+
+def test_should_fail_user_when_an_order_raises_in_any_chunk(mock_api_client: MockAPIClient) -> None:
+    # Arrange
+    orders = [Order(id=order_id, type='C', amount=100.0, flag=True) for order_id in range(1, 51)]
+    db_service = InMemoryDatabaseService({1: orders, 2: [Order(id=99, type='C', amount=1.0, flag=True)]})
+    original_update = db_service.update_order_status
+
+    def update(order_id: int, status: str, priority: str) -> bool:
+        if order_id == 25:
+            raise RuntimeError('connection reset')
+        return original_update(order_id, status, priority)
+
+    db_service.update_order_status = update
+    scheduler = WorkStealingScheduler(OrderProcessingService(db_service, mock_api_client), workers=2, chunk_size=5)
+
+    # Act
+    results = scheduler.run([1, 2])
+
+    # Assert
+    assert results == {1: False, 2: True}
+    assert not scheduler.reports[1].success
+
+
+def test_should_cut_adaptive_limit_when_scripted_latency_degrades_and_grow_it_back() -> None:
+    # Arrange
+    clock = FakeClock()
+    api = ScriptedLatencyAPIClient(
+        lambda elapsed, in_flight: 0.5 if 1.0 <= elapsed < 2.5 else 0.01,
+        clock=clock,
+        sleep=clock.sleep
+    )
+    client = AdaptiveAPIClient(api, latency_target=0.1, initial_limit=8, clock=clock)
+    limits = [client.current_limit]
+
+    # Act
+    while clock.now < 4.0:
+        client.call_api(1)
+        if client.current_limit != limits[-1]:
+            limits.append(client.current_limit)
+
+    # Assert
+    assert limits == [8, 4, 2, 1, 2]
+    assert client.metrics()['limit_decreases'] == 3
+    assert client.metrics()['slow_calls'] == 3
+
+
+def test_should_cut_adaptive_limit_on_api_failures(mock_db_service: MockDatabaseService) -> None:
+    # Arrange
+    clock = FakeClock()
+    api = ScriptedLatencyAPIClient(lambda elapsed, in_flight: 0.2, error_above=0.1, clock=clock, sleep=clock.sleep)
+    client = AdaptiveAPIClient(api, latency_target=1.0, initial_limit=4, clock=clock)
+    mock_db_service.get_orders_by_user = Mock(return_value=[Order(id=1, type='B', amount=80.0, flag=False)])
+    mock_db_service.update_order_status = Mock(return_value=True)
+    service = OrderProcessingService(mock_db_service, client)
+
+    # Act
+    service.process_orders(user_id=1)
+
+    # Assert
+    mock_db_service.update_order_status.assert_called_once_with(1, 'api_failure', 'low')
+    assert client.current_limit == 2
+    assert client.metrics()['failed_calls'] == 1
+    assert client.in_flight == 0
+
+
+def test_should_hold_calls_beyond_the_adaptive_limit() -> None:
+    # Arrange
+    api = BlockingAPIClient(APIResponse('success', 60))
+    client = AdaptiveAPIClient(api, latency_target=10.0, initial_limit=2)
+    threads = [threading.Thread(target=client.call_api, args=(order_id,)) for order_id in range(5)]
+
+    # Act
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: api.calls == 2)
+    time.sleep(0.05)
+    calls_while_blocked = api.calls
+    api.release.set()
+    for thread in threads:
+        thread.join()
+
+    # Assert
+    assert calls_while_blocked == 2
+    assert api.calls == 5
+    assert client.max_in_flight == 2
+
+
+class SlowFirstCallAPIClient(APIClient):
+    # The first call for an order in slow_ids hangs until release(order_id);
+    # every other call answers at once.
+    def __init__(self, slow_ids) -> None:
+        self.releases = {order_id: threading.Event() for order_id in slow_ids}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def release(self, order_id: int, delay: float = 0.0) -> None:
+        threading.Timer(delay, self.releases[order_id].set).start()
+
+    def call_api(self, order_id: int) -> APIResponse:
+        with self._lock:
+            first = order_id not in self.calls
+            self.calls.append(order_id)
+        if first and order_id in self.releases:
+            self.releases[order_id].wait(timeout=5)
+            return APIResponse('success', 1)
+        return APIResponse('success', 99)
+
+
+def test_should_answer_from_hedge_when_first_call_is_slow() -> None:
+    # Arrange
+    api = SlowFirstCallAPIClient(slow_ids=[100])
+    client = HedgingAPIClient(api, max_hedge_ratio=0.5, min_samples=5)
+    for order_id in range(5):
+        client.call_api(order_id)
+
+    # Act
+    response = client.call_api(100)
+    api.release(100)
+    client.close()
+
+    # Assert
+    assert response.data == 99
+    assert api.calls.count(100) == 2
+    assert client.metrics()['hedged_calls'] == 1
+    assert client.metrics()['hedge_wins'] == 1
+
+
+def test_should_not_hedge_beyond_max_hedge_ratio_or_before_min_samples() -> None:
+    # Arrange
+    api = SlowFirstCallAPIClient(slow_ids=[1, 100, 101])
+    client = HedgingAPIClient(api, max_hedge_ratio=0.15, min_samples=5)
+    api.release(1, delay=0.05)
+    unhedged_warm_up = client.call_api(1)
+    for order_id in range(2, 7):
+        client.call_api(order_id)
+
+    # Act
+    hedged = client.call_api(100)
+    api.release(101, delay=0.05)
+    capped = client.call_api(101)
+    api.release(100)
+    client.close()
+
+    # Assert
+    assert unhedged_warm_up.data == 1
+    assert hedged.data == 99
+    assert capped.data == 1
+    assert api.calls.count(101) == 1
+    assert client.metrics()['hedged_calls'] == 1
+    assert client.metrics()['hedge_rate'] == pytest.approx(1 / 8)
+
+
+def test_should_use_other_answer_when_first_one_fails() -> None:
+    # Arrange
+    class FailFastAPIClient(SlowFirstCallAPIClient):
+        def call_api(self, order_id: int) -> APIResponse:
+            if order_id == 100 and self.calls.count(100) == 1:
+                self.calls.append(order_id)
+                raise APIException('connection reset')
+            return super().call_api(order_id)
+
+    api = FailFastAPIClient(slow_ids=[100])
+    client = HedgingAPIClient(api, max_hedge_ratio=1.0, min_samples=5)
+    for order_id in range(5):
+        client.call_api(order_id)
+    api.release(100, delay=0.05)
+
+    # Act
+    response = client.call_api(100)
+    client.close()
+
+    # Assert
+    assert response.data == 1
+    assert client.metrics()['hedge_wins'] == 0
+
+
+def test_should_fetch_users_in_groups_and_keep_process_orders_results(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    orders_by_user = {
+        user_id: [Order(id=user_id * 10 + 1, type='C', amount=100.0, flag=user_id % 2 == 0)]
+        for user_id in range(1, 6)
+    }
+    orders_by_user[3] = []
+    mock_db_service.get_orders_by_user = Mock(side_effect=AssertionError('fetched one user at a time'))
+    mock_db_service.get_orders_by_users = Mock(
+        side_effect=lambda user_ids: {user_id: orders_by_user[user_id] for user_id in user_ids if user_id in orders_by_user}
+    )
+    mock_db_service.update_order_status = Mock(return_value=True)
+    service = OrderProcessingService(mock_db_service, mock_api_client)
+
+    # Act
+    results = service.process_users([1, 2, 3, 4, 5, 6, 7], group_size=3)
+
+    # Assert
+    assert results == {1: True, 2: True, 3: False, 4: True, 5: True, 6: False, 7: False}
+    assert [call.args[0] for call in mock_db_service.get_orders_by_users.call_args_list] == [[1, 2, 3], [4, 5, 6], [7]]
+    assert orders_by_user[2][0].status == 'completed'
+    assert orders_by_user[1][0].status == 'in_progress'
+    assert service.last_report.user_id == 7
+
+
+def test_should_fall_back_to_per_user_fetches_when_bulk_fetch_raises(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    def get_orders_by_users(user_ids):
+        if 3 in user_ids:
+            raise DatabaseException('query timed out')
+        return {user_id: [Order(id=user_id, type='C', amount=100.0, flag=True)] for user_id in user_ids}
+
+    mock_db_service.get_orders_by_users = Mock(side_effect=get_orders_by_users)
+    mock_db_service.get_orders_by_user = Mock(return_value=[Order(id=4, type='C', amount=100.0, flag=True)])
+    mock_db_service.update_order_status = Mock(return_value=True)
+    service = OrderProcessingService(mock_db_service, mock_api_client)
+
+    # Act
+    results = service.process_users([1, 2, 3, 4], group_size=2)
+
+    # Assert
+    assert results == {1: True, 2: True, 3: True, 4: True}
+    assert [call.args[0] for call in mock_db_service.get_orders_by_user.call_args_list] == [3, 4]
+
+
+def test_should_fail_only_the_user_whose_fetch_raises_like_process_orders(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    def get_orders_by_user(user_id):
+        if user_id == 2:
+            raise DatabaseException('row lock timeout')
+        return [Order(id=user_id, type='C', amount=100.0, flag=True)]
+
+    mock_db_service.get_orders_by_user = Mock(side_effect=get_orders_by_user)
+    mock_db_service.update_order_status = Mock(return_value=True)
+    service = OrderProcessingService(mock_db_service, mock_api_client)
+    expected = {user_id: service.process_orders(user_id) for user_id in [1, 2, 3]}
+
+    # Act
+    results = service.process_users([1, 2, 3], group_size=3)
+
+    # Assert
+    assert expected == {1: True, 2: False, 3: True}
+    assert results == expected
+
+
+def test_should_fetch_each_user_by_default_for_bulk_fetch() -> None:
+    # Arrange
+    order = Order(id=1, type='C', amount=100.0, flag=True)
+    db_service = BatchingDatabaseService(InMemoryDatabaseService({1: [order]}))
+
+    # Act
+    orders_by_user = db_service.get_orders_by_users([1, 2])
+    db_service.close()
+
+    # Assert
+    assert orders_by_user == {1: [order], 2: []}
+
+
+def test_should_fetch_next_user_while_current_user_is_processed(mock_api_client: MockAPIClient) -> None:
+    # Arrange
+    orders_by_user = {user_id: [Order(id=user_id, type='C', amount=100.0, flag=True)] for user_id in range(1, 4)}
+    next_user_fetched = threading.Event()
+    overlapped = []
+
+    class ObservedDatabaseService(InMemoryDatabaseService):
+        def get_orders_by_user(self, user_id: int) -> list:
+            if user_id == 2:
+                next_user_fetched.set()
+            return super().get_orders_by_user(user_id)
+
+        def update_order_status(self, order_id: int, status: str, priority: str) -> bool:
+            if order_id == 1:
+                overlapped.append(next_user_fetched.wait(timeout=5))
+            return super().update_order_status(order_id, status, priority)
+
+    driver = PrefetchingDriver(OrderProcessingService(ObservedDatabaseService(orders_by_user), mock_api_client))
+
+    # Act
+    results = driver.run([1, 2, 3])
+
+    # Assert
+    assert overlapped == [True]
+    assert results == {1: True, 2: True, 3: True}
+
+
+def test_should_bound_prefetched_users_by_lookahead(mock_api_client: MockAPIClient) -> None:
+    # Arrange
+    fetched = []
+    release = threading.Event()
+
+    class BlockingDatabaseService(InMemoryDatabaseService):
+        def get_orders_by_user(self, user_id: int) -> list:
+            fetched.append(user_id)
+            return super().get_orders_by_user(user_id)
+
+        def update_order_status(self, order_id: int, status: str, priority: str) -> bool:
+            if order_id == 1:
+                release.wait(timeout=5)
+            return super().update_order_status(order_id, status, priority)
+
+    orders_by_user = {user_id: [Order(id=user_id, type='C', amount=100.0, flag=True)] for user_id in range(1, 11)}
+    driver = PrefetchingDriver(OrderProcessingService(BlockingDatabaseService(orders_by_user), mock_api_client), lookahead=2)
+    results = {}
+    runner = threading.Thread(target=lambda: results.update(driver.run(range(1, 11))))
+
+    # Act
+    runner.start()
+    wait_until(lambda: len(fetched) == 4)
+    time.sleep(0.05)
+    fetched_while_blocked = len(fetched)
+    release.set()
+    runner.join()
+
+    # Assert
+    assert fetched_while_blocked == 4
+    assert results == {user_id: True for user_id in range(1, 11)}
+
+
+def test_should_report_empty_and_failed_prefetches_as_false(
+    mock_db_service: MockDatabaseService,
+    mock_api_client: MockAPIClient
+) -> None:
+    # Arrange
+    def get_orders_by_user(user_id):
+        if user_id == 2:
+            raise DatabaseException('connection lost')
+        return [Order(id=1, type='C', amount=100.0, flag=True)] if user_id == 1 else []
+
+    mock_db_service.get_orders_by_user = Mock(side_effect=get_orders_by_user)
+    mock_db_service.update_order_status = Mock(return_value=True)
+    driver = PrefetchingDriver(OrderProcessingService(mock_db_service, mock_api_client), lookahead=1)
+
+    # Act
+    results = driver.run([1, 2, 3])
+
+    # Assert
+    assert results == {1: True, 2: False, 3: False}
+
+
+def _csv_edge_case_orders() -> list:
+    orders = [
+        Order(id=1, type='A', amount=100.0, flag=False),
+        Order(id=2, type='A', amount=150.01, flag=True),
+        Order(id=3, type='A,B', amount=float('nan'), flag=None),
+        Order(id=4, type='say "hi"', amount=1e20, flag=1),
+        Order(id=5, type='line\nbreak', amount=-0.0, flag='Yes, "sir"'),
+        Order(id=6, type='carriage\rreturn', amount=151, flag=0),
+        Order(id=7, type='', amount=0.1 + 0.2, flag=False),
+        Order(id=8, type=' padded ', amount=float('inf'), flag=True),
+        Order(id=9, type='tab\tsemi;colon', amount=200.5, flag=False)
+    ]
+    orders[0].status, orders[0].priority = 'exported', 'low'
+    orders[1].status, orders[1].priority = '"quoted", status', None
+    orders[2].status, orders[2].priority = None, 'high'
+    orders[3].status, orders[3].priority = '', 'multi\r\nline'
+    return orders
+
+
+def test_should_export_byte_identical_csv_with_fast_encoder(tmp_path) -> None:
+    # Arrange
+    slow_dir = tmp_path / 'csv_writer'
+    fast_dir = tmp_path / 'fast'
+    slow_dir.mkdir()
+    fast_dir.mkdir()
+    slow = OrderExporter(str(slow_dir))
+    fast = OrderExporter(str(fast_dir), fast_csv=True)
+
+    # Act
+    for user_id, order in enumerate(_csv_edge_case_orders()):
+        assert slow.export_order_to_csv(order, user_id) == 'exported'
+        assert fast.export_order_to_csv(order, user_id) == 'exported'
+
+    # Assert
+    for user_id in range(len(_csv_edge_case_orders())):
+        [slow_file] = slow_dir.glob(f'orders_type_A_{user_id}_*.csv')
+        [fast_file] = fast_dir.glob(f'orders_type_A_{user_id}_*.csv')
+        assert fast_file.read_bytes() == slow_file.read_bytes()
+
+
+def test_should_write_bulk_csv_identical_to_csv_writer() -> None:
+    # Arrange
+    orders = _csv_edge_case_orders() * 3
+    expected = io.StringIO()
+    writer = csv.writer(expected)
+    writer.writerow(['ID', 'Type', 'Amount', 'Flag', 'Status', 'Priority'])
+    for order in orders:
+        writer.writerow([order.id, order.type, order.amount, str(order.flag).lower(), order.status, order.priority])
+        if order.amount > 150:
+            writer.writerow(['', '', '', '', 'Note', 'High value order'])
+    output = io.StringIO()
+
+    # Act
+    rows = write_orders_csv(output, orders, chunk_rows=4)
+
+    # Assert
+    assert rows == len(orders)
+    assert output.getvalue() == expected.getvalue()